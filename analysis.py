@@ -0,0 +1,140 @@
+"""Module containing a background analysis of the position being played
+
+The search runs in its own process, so that it never slows down the
+window, and keeps searching deeper until it is given a new position.
+Positions are sent as snapshots with a generation number; a new position
+bumps the shared generation, which the running search checks every 1024
+nodes to stop at once. Results of the current position come back through
+a queue, and a notify callback tells the GUI that one is waiting.
+
+Usage:
+    worker = AnalysisWorker(notify=callback).start()
+    worker.analyse(engine)       # after every make_move and undo_move
+    info = worker.latest()       # best AnalysisInfo so far, or None
+    worker.close()
+
+Classes:
+    AnalysisInfo
+    AnalysisWorker
+"""
+import multiprocessing
+import queue
+import threading
+
+from chess_engine import ChessEngine
+from search import Search, SearchTimeout
+
+
+class AnalysisInfo():
+    """Class used to store the result of one completed depth, with the
+    score from the point of view of white"""
+
+    def __init__(self, generation, depth, score, pv, nodes):
+        self.generation = generation
+        self.depth = depth
+        self.score = score
+        self.pv = pv
+        self.nodes = nodes
+
+    @property
+    def best_move(self):
+        return self.pv[0] if self.pv else None
+
+
+class AnalysisSearch(Search):
+    """Search that stops as soon as the shared generation moves on"""
+
+    def __init__(self, engine, generation):
+        super().__init__(engine)
+        self.generation = generation
+        self.job = 0
+
+    def check_limits(self):
+        if self.generation.value != self.job:
+            raise SearchTimeout
+        super().check_limits()
+
+
+def _analyse_positions(jobs, results, generation):
+    """Search every position received from jobs until None arrives"""
+    engine = ChessEngine()
+    searcher = AnalysisSearch(engine, generation)
+    while True:
+        job = jobs.get()
+        if job is None:
+            results.put(None)
+            return
+        searcher.job, position, keys = job
+        if searcher.job != generation.value:
+            continue  # replaced before it started
+        engine.restore(position)
+        engine.key_log.extend(keys)
+        sign = 1 if engine.white_to_move else -1
+
+        def callback(result, job=searcher.job):
+            results.put(AnalysisInfo(job, result.depth, sign * result.score,
+                                     result.pv, result.nodes))
+
+        searcher.search(callback=callback)
+
+
+class AnalysisWorker():
+    """Class used to analyse positions in a background process"""
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.jobs = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.generation = multiprocessing.Value("i", 0)
+        self.process = multiprocessing.Process(
+            target=_analyse_positions, args=(self.jobs, self.results, self.generation),
+            daemon=True)
+        # results of the current position, for the GUI thread
+        self.queue = queue.Queue()
+        self.relay = threading.Thread(target=self.relay_results, daemon=True)
+
+    def start(self):
+        self.process.start()
+        self.relay.start()
+        return self
+
+    def analyse(self, engine):
+        """Stop the running analysis and start on the position of engine"""
+        with self.generation.get_lock():
+            self.generation.value += 1
+            job = self.generation.value
+        clock = engine.halfmove_clock
+        keys = tuple(engine.key_log[-clock:]) if clock else ()
+        self.jobs.put((job, engine.snapshot(), keys))
+
+    def relay_results(self):
+        """Pass the results of the current position on to the queue"""
+        while True:
+            info = self.results.get()
+            if info is None:
+                return
+            if info.generation == self.generation.value:
+                self.queue.put(info)
+                if self.notify is not None:
+                    self.notify()
+
+    def latest(self):
+        """Return the deepest result received for the current position, or
+        None"""
+        info = None
+        while True:
+            try:
+                info = self.queue.get_nowait()
+            except queue.Empty:
+                break
+        if info is not None and info.generation != self.generation.value:
+            return None
+        return info
+
+    def close(self):
+        with self.generation.get_lock():
+            self.generation.value += 1
+        self.jobs.put(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
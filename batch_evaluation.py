@@ -0,0 +1,192 @@
+"""Module containing a NumPy evaluation of many positions at once
+
+Positions are stored as an (N, 64) int8 array of piece codes, the same
+codes and square order as ChessEngine.squares. They can be built from
+engines or FENs without looping over squares in Python, turned into
+(N, 12, 64) piece planes, and scored in a few vectorized passes.
+
+With mobility and pawn structure turned off, evaluate_batch returns
+exactly what evaluation.evaluate returns for each position.
+
+Functions:
+    boards_from_engines
+    boards_from_fens
+    planes_from_boards
+    evaluate_batch
+"""
+import numpy as np
+
+from bitboard import WHITE, BLACK, EMPTY
+from bitboard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from bitboard import PIECE_CODES
+from evaluation import MIDDLEGAME_SCORES, ENDGAME_SCORES
+from evaluation import PHASE_WEIGHTS, TOTAL_PHASE
+
+MOBILITY_WEIGHT = 2
+DOUBLED_PAWN_PENALTY = 10
+ISOLATED_PAWN_PENALTY = 15
+PASSED_PAWN_BONUS = 20
+
+# piece codes in the order of the 12 planes: white P N B R Q K, then black
+PLANE_PIECES = np.array([color << 3 | kind for color in (WHITE, BLACK)
+                         for kind in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)],
+                        dtype=np.int8)
+
+_MIDDLEGAME = np.array(MIDDLEGAME_SCORES, dtype=np.int32)
+_ENDGAME = np.array(ENDGAME_SCORES, dtype=np.int32)
+_PHASE = np.array(PHASE_WEIGHTS + [0], dtype=np.int32)
+_SQUARES = np.arange(64)
+
+# FEN character code -> piece code, anything else maps to EMPTY
+_FEN_CODES = np.zeros(256, dtype=np.int8)
+for _name, _code in PIECE_CODES.items():
+    if _code != EMPTY:
+        _FEN_CODES[ord(_name[1] if _name[0] == "w" else _name[1].lower())] = _code
+_EXPAND_DIGITS = str.maketrans({str(n): "." * n for n in range(1, 9)} | {"/": ""})
+
+STRAIGHT_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+DIAGONAL_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+KNIGHT_OFFSETS = ((-1, -2), (-1, 2), (-2, -1), (-2, 1),
+                  (1, -2), (1, 2), (2, -1), (2, 1))
+
+# _AHEAD[color][sq, other] is set for the squares on the same or adjacent
+# files in front of a pawn of color on sq, where enemy pawns stop it from
+# being passed
+_AHEAD = np.zeros((2, 64, 64), dtype=bool)
+for _sq in range(64):
+    _row, _col = divmod(_sq, 8)
+    for _other in range(64):
+        _r, _c = divmod(_other, 8)
+        if abs(_c - _col) <= 1:
+            _AHEAD[WHITE, _sq, _other] = _r < _row
+            _AHEAD[BLACK, _sq, _other] = _r > _row
+# transposed as float32 so that the blocker count is a BLAS product
+_AHEAD_T = np.ascontiguousarray(_AHEAD.transpose(0, 2, 1), dtype=np.float32)
+
+
+def boards_from_engines(engines):
+    """Return the (N, 64) boards and (N,) side to move of many engines"""
+    boards = np.array([engine.squares for engine in engines], dtype=np.int8).reshape(-1, 64)
+    white_to_move = np.array([engine.white_to_move for engine in engines], dtype=bool)
+    return boards, white_to_move
+
+
+def boards_from_fens(fens):
+    """Return the (N, 64) boards and (N,) side to move of many FENs
+
+    Only the piece placement and the side to move are read. Digits are
+    expanded with str.translate and the characters of every board are
+    decoded in a single lookup.
+    """
+    placements = []
+    white_to_move = []
+    for fen in fens:
+        fields = fen.split()
+        placement = fields[0].translate(_EXPAND_DIGITS)
+        if len(placement) != 64:
+            raise ValueError(f"invalid piece placement in FEN: {fen!r}")
+        placements.append(placement)
+        white_to_move.append(len(fields) < 2 or fields[1] == "w")
+
+    chars = np.frombuffer("".join(placements).encode("ascii"), dtype=np.uint8)
+    boards = _FEN_CODES[chars].reshape(-1, 64)
+    return boards, np.array(white_to_move, dtype=bool)
+
+
+def planes_from_boards(boards):
+    """Turn (N, 64) boards into (N, 12, 64) uint8 piece planes"""
+    boards = np.asarray(boards, dtype=np.int8)
+    return (boards[:, None, :] == PLANE_PIECES[None, :, None]).astype(np.uint8)
+
+
+def evaluate_batch(boards, white_to_move=None, mobility=True, pawn_structure=True,
+                   chunk_size=4096):
+    """Score every position of an (N, 64) board array in centipawns
+
+    Scores are from white's point of view, or from the side to move when
+    the (N,) white_to_move array is given. Positions are processed in
+    chunks of chunk_size to bound the memory used by the mobility term.
+    """
+    boards = np.asarray(boards, dtype=np.int8).reshape(-1, 64)
+    scores = np.empty(len(boards), dtype=np.int32)
+    for begin in range(0, len(boards), chunk_size):
+        chunk = boards[begin:begin + chunk_size]
+        score = _material_and_squares(chunk)
+        if mobility:
+            score += MOBILITY_WEIGHT * (_mobility(chunk, WHITE) - _mobility(chunk, BLACK))
+        if pawn_structure:
+            score += _pawn_structure(chunk, WHITE) - _pawn_structure(chunk, BLACK)
+        scores[begin:begin + chunk_size] = score
+
+    if white_to_move is not None:
+        scores = np.where(np.asarray(white_to_move, dtype=bool), scores, -scores)
+    return scores
+
+
+def _material_and_squares(boards):
+    middlegame = _MIDDLEGAME[boards, _SQUARES].sum(axis=1)
+    endgame = _ENDGAME[boards, _SQUARES].sum(axis=1)
+    phase = np.minimum(_PHASE[boards & 7].sum(axis=1), TOTAL_PHASE)
+    return (middlegame * phase + endgame * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+
+def _shift(grids, d_row, d_col):
+    """Move every square of (N, 8, 8) grids by (d_row, d_col), dropping the
+    squares that leave the board"""
+    shifted = np.zeros_like(grids)
+    rows = slice(max(d_row, 0), 8 + min(d_row, 0))
+    cols = slice(max(d_col, 0), 8 + min(d_col, 0))
+    from_rows = slice(max(-d_row, 0), 8 + min(-d_row, 0))
+    from_cols = slice(max(-d_col, 0), 8 + min(-d_col, 0))
+    shifted[:, rows, cols] = grids[:, from_rows, from_cols]
+    return shifted
+
+
+def _mobility(boards, color):
+    """Count the squares the knights, bishops, rooks and queens of color
+    can move to, ignoring pins and checks"""
+    grids = boards.reshape(-1, 8, 8)
+    pieces = grids & 7
+    own = (grids != EMPTY) & ((grids >> 3) == color)
+    empty = grids == EMPTY
+    targets = ~own
+
+    moves = np.zeros(len(boards), dtype=np.int64)
+    knights = own & (pieces == KNIGHT)
+    for d_row, d_col in KNIGHT_OFFSETS:
+        moves += np.count_nonzero(_shift(knights, d_row, d_col) & targets, axis=(1, 2))
+
+    queens = pieces == QUEEN
+    for directions, sliders in ((STRAIGHT_DIRECTIONS, own & ((pieces == ROOK) | queens)),
+                                (DIAGONAL_DIRECTIONS, own & ((pieces == BISHOP) | queens))):
+        for d_row, d_col in directions:
+            # slide one step at a time, only through empty squares; a slider
+            # behind another on the same line is always blocked by it
+            frontier = sliders
+            for _ in range(7):
+                frontier = _shift(frontier, d_row, d_col)
+                moves += np.count_nonzero(frontier & targets, axis=(1, 2))
+                frontier &= empty
+                if not frontier.any():
+                    break
+    return moves
+
+
+def _pawn_structure(boards, color):
+    """Score doubled, isolated and passed pawns of color"""
+    pawns = boards == (color << 3 | PAWN)
+    enemy_pawns = boards == ((color ^ 1) << 3 | PAWN)
+
+    files = np.count_nonzero(pawns.reshape(-1, 8, 8), axis=1)
+    doubled = np.maximum(files - 1, 0).sum(axis=1)
+    has_pawn = files > 0
+    neighbours = np.zeros_like(has_pawn)
+    neighbours[:, 1:] |= has_pawn[:, :-1]
+    neighbours[:, :-1] |= has_pawn[:, 1:]
+    isolated = (files * ~neighbours).sum(axis=1)
+
+    blockers = enemy_pawns.astype(np.float32) @ _AHEAD_T[color]
+    passed = np.count_nonzero(pawns & (blockers == 0), axis=1)
+
+    return (PASSED_PAWN_BONUS * passed - DOUBLED_PAWN_PENALTY * doubled
+            - ISOLATED_PAWN_PENALTY * isolated)
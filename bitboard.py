@@ -0,0 +1,165 @@
+"""Module containing bitboard constants and precomputed attack tables
+
+Squares are numbered following the layout of ChessEngine.board, so
+square = row * 8 + col, a8 is square 0 and h1 is square 63.
+Bit n of a bitboard is set when square n is part of the set.
+
+Pieces are stored as small integers: the lower 3 bits hold the piece type
+and bit 3 holds the color, so white pieces are 1-6 and black pieces 9-14.
+"""
+
+WHITE = 0
+BLACK = 1
+
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+
+PIECE_NAMES = ["--"] * 15
+PIECE_CODES = {"--": EMPTY}
+for _color, _letter in ((WHITE, "w"), (BLACK, "b")):
+    for _kind, _name in enumerate("PNBRQK", start=PAWN):
+        PIECE_NAMES[_color << 3 | _kind] = _letter + _name
+        PIECE_CODES[_letter + _name] = _color << 3 | _kind
+
+ALL_SQUARES = (1 << 64) - 1
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+RANK_8 = 0xFF
+RANK_1 = RANK_8 << 56
+
+
+def square(row, col):
+    return row * 8 + col
+
+
+def row_col(sq):
+    return sq >> 3, sq & 7
+
+
+def lsb(bb):
+    """Return the index of the lowest set bit"""
+    return (bb & -bb).bit_length() - 1
+
+
+def squares(bb):
+    """Yield the index of every set bit, lowest first"""
+    while bb:
+        bit = bb & -bb
+        yield bit.bit_length() - 1
+        bb ^= bit
+
+
+def popcount(bb):
+    return bin(bb).count("1")
+
+
+def _step_attacks(offsets):
+    table = []
+    for sq in range(64):
+        row, col = row_col(sq)
+        attacks = 0
+        for d_row, d_col in offsets:
+            r, c = row + d_row, col + d_col
+            if 0 <= r <= 7 and 0 <= c <= 7:
+                attacks |= 1 << square(r, c)
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks(((-1, -2), (-1, 2), (-2, -1), (-2, 1),
+                                (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _step_attacks(((1, 1), (1, 0), (1, -1), (0, -1),
+                              (-1, -1), (-1, 0), (-1, 1), (0, 1)))
+# squares attacked by a pawn of the given color standing on each square
+PAWN_ATTACKS = (_step_attacks(((-1, -1), (-1, 1))),
+                _step_attacks(((1, -1), (1, 1))))
+
+
+def _ray_attacks(sq, occupied, directions):
+    """Slow reference implementation, only used to fill the tables"""
+    row, col = row_col(sq)
+    attacks = 0
+    for d_row, d_col in directions:
+        r, c = row + d_row, col + d_col
+        while 0 <= r <= 7 and 0 <= c <= 7:
+            bit = 1 << square(r, c)
+            attacks |= bit
+            if occupied & bit:
+                break
+            r, c = r + d_row, c + d_col
+    return attacks
+
+
+def _line_table(directions):
+    """Build occupancy-indexed attack lookups along a single line
+
+    For each square the mask holds the squares of the line that can block a
+    slider (board edges excluded), and the table maps every subset of that
+    mask to the resulting attack set. This plays the role of magic
+    bitboards without the big-integer multiplication, which is slow in Python.
+    """
+    masks = []
+    tables = []
+    for sq in range(64):
+        row, col = row_col(sq)
+        mask = 0
+        for d_row, d_col in directions:
+            r, c = row + d_row, col + d_col
+            while 0 <= r + d_row <= 7 and 0 <= c + d_col <= 7:
+                mask |= 1 << square(r, c)
+                r, c = r + d_row, c + d_col
+        table = {}
+        subset = 0
+        while True:  # enumerate all subsets of mask (Carry-Rippler trick)
+            table[subset] = _ray_attacks(sq, subset, directions)
+            subset = (subset - mask) & mask
+            if not subset:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+RANK_MASKS, RANK_ATTACKS = _line_table(((0, 1), (0, -1)))
+FILE_MASKS, FILE_ATTACKS = _line_table(((1, 0), (-1, 0)))
+DIAGONAL_MASKS, DIAGONAL_ATTACKS = _line_table(((1, 1), (-1, -1)))
+ANTI_DIAGONAL_MASKS, ANTI_DIAGONAL_ATTACKS = _line_table(((1, -1), (-1, 1)))
+
+
+def rook_attacks(sq, occupied):
+    return (RANK_ATTACKS[sq][occupied & RANK_MASKS[sq]]
+            | FILE_ATTACKS[sq][occupied & FILE_MASKS[sq]])
+
+
+def bishop_attacks(sq, occupied):
+    return (DIAGONAL_ATTACKS[sq][occupied & DIAGONAL_MASKS[sq]]
+            | ANTI_DIAGONAL_ATTACKS[sq][occupied & ANTI_DIAGONAL_MASKS[sq]])
+
+
+def queen_attacks(sq, occupied):
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+def _between_table():
+    """BETWEEN[a][b] holds the squares strictly between a and b when they
+    share a rank, file or diagonal, and 0 otherwise"""
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        row, col = row_col(sq)
+        for d_row, d_col in ((1, 1), (1, 0), (1, -1), (0, -1),
+                             (-1, -1), (-1, 0), (-1, 1), (0, 1)):
+            ray = 0
+            r, c = row + d_row, col + d_col
+            while 0 <= r <= 7 and 0 <= c <= 7:
+                table[sq][square(r, c)] = ray
+                ray |= 1 << square(r, c)
+                r, c = r + d_row, c + d_col
+    return table
+
+
+BETWEEN = _between_table()
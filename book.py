@@ -0,0 +1,250 @@
+"""Module containing a Polyglot opening book reader and builder
+
+Book files are sorted arrays of 16 byte entries (position key, move,
+weight, learn), read through mmap so that a large book is never loaded
+into memory and is shared by every process that opens it.
+
+Keys come from the zobrist module, which uses the Polyglot random numbers,
+so books made by other Polyglot tools can be read as well.
+
+Usage:
+    python book.py build games.pgn book.bin --plies 16
+    python book.py probe book.bin --fen "<FEN>"
+    python book.py check                 # compare keys with the Polyglot ones
+
+Classes:
+    OpeningBook
+
+Functions:
+    build_book
+    encode_book_move
+    check_keys
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+
+from chess_engine import ChessEngine
+from chess_engine import START_FEN, CASTLING_ROOK_SQUARES
+from bitboard import KING
+from moves import Move
+from moves import CASTLING, FLAG_SHIFT, PROMOTION_SHIFT
+from pgn import read_games, replay, PGNError
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+
+# games score 2 points for each move of the winner and 1 for a draw
+WIN_POINTS = 2
+DRAW_POINTS = 1
+MAX_WEIGHT = 0xFFFF
+
+# keys given by the Polyglot specification after playing moves from the
+# start position
+POLYGLOT_KEYS = [
+    ([], 0x463B96181691FC9C),
+    (["e2e4"], 0x823C9B50FD114196),
+    (["e2e4", "d7d5"], 0x0756B94461C50FB0),
+    (["e2e4", "d7d5", "e4e5"], 0x662FAFB965DB29D4),
+    (["e2e4", "d7d5", "e4e5", "f7f5"], 0x22A48B5A8E47FF78),
+    (["e2e4", "d7d5", "e4e5", "f7f5", "e1e2"], 0x652A607CA3F242C1),
+    (["e2e4", "d7d5", "e4e5", "f7f5", "e1e2", "e8f7"], 0x00FDD303C946BDD9),
+    (["a2a4", "b7b5", "h2h4", "b5b4", "c2c4"], 0x3C8123EA7B067637),
+    (["a2a4", "b7b5", "h2h4", "b5b4", "c2c4", "b4c3", "a1a3"], 0x5C3F9B829B279560),
+]
+
+# Polyglot writes castling as the king taking its own rook
+ROOK_SQUARE_OF_CASTLING = {end: rook_start for end, (rook_start, _) in CASTLING_ROOK_SQUARES.items()}
+
+
+def encode_book_move(move):
+    """Return the 16 bit Polyglot encoding of an engine move"""
+    start = move & 63
+    end = move >> 6 & 63
+    if move >> FLAG_SHIFT & 3 == CASTLING:
+        end = ROOK_SQUARE_OF_CASTLING[end]
+    promotion = move >> PROMOTION_SHIFT & 7
+    # Polyglot counts rows from rank 1 upwards, the engine from rank 8 down
+    return (end ^ 56) | (start ^ 56) << 6 | (promotion - 1 if promotion else 0) << 12
+
+
+class OpeningBook():
+    """Class used to look up the book moves of a position"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.size = self.file.seek(0, 2) // ENTRY.size
+        # mmap cannot map an empty file
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if self.size:
+            self.data.close()
+        self.file.close()
+
+    def entries(self, key):
+        """Return the (move, weight, learn) entries stored for a key"""
+        # binary search for the first entry with this key
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        entries = []
+        for index in range(low, self.size):
+            entry_key, move, weight, learn = ENTRY.unpack_from(self.data, index * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight, learn))
+        return entries
+
+    def get_moves(self, engine):
+        """Return the (Move, weight) pairs of the book that are legal in the
+        position of engine, highest weight first"""
+        entries = self.entries(engine.zobrist_key)
+        if not entries:
+            return []
+
+        legal = {encode_book_move(move): move for move in engine.get_valid_moves()}
+        moves = []
+        for book_move, weight, _ in entries:
+            move = legal.get(book_move)
+            if move is None and book_move & 0x7000 == 0:
+                # other tools may write castling as a two square king move
+                start = (book_move >> 6 & 63) ^ 56
+                end = (book_move & 63) ^ 56
+                if engine.squares[start] & 7 == KING and end in ROOK_SQUARE_OF_CASTLING:
+                    move = legal.get(book_move & ~63 | ROOK_SQUARE_OF_CASTLING[end] ^ 56)
+            if move is not None:
+                moves.append((Move(move), weight))
+        moves.sort(key=lambda pair: pair[1], reverse=True)
+        return moves
+
+    def choose_move(self, engine, rng=random):
+        """Pick a book move at random in proportion to its weight, or return
+        None when the position is not in the book"""
+        moves = [(move, weight) for move, weight in self.get_moves(engine) if weight]
+        if not moves:
+            return None
+        return rng.choices([move for move, _ in moves],
+                           weights=[weight for _, weight in moves])[0]
+
+
+def build_book(games, path, max_plies=16, min_games=1, trusted=True):
+    """Write a Polyglot book with the first max_plies moves of games
+
+    games is an iterable of pgn.PGNGame, such as pgn.read_games(file). Each
+    move scores WIN_POINTS when its side won and DRAW_POINTS for a draw;
+    moves played in fewer than min_games games are left out. Return the
+    number of entries written.
+    """
+    # (key, book move) -> [games, points]
+    stats = {}
+    for game in games:
+        points = {"1-0": (WIN_POINTS, 0), "0-1": (0, WIN_POINTS),
+                  "1/2-1/2": (DRAW_POINTS, DRAW_POINTS)}.get(game.result, (0, 0))
+        engine = game.start_engine()
+        key = engine.zobrist_key
+        white_to_move = engine.white_to_move
+        try:
+            for ply, move in enumerate(replay(game, engine, trusted)):
+                entry = stats.setdefault((key, encode_book_move(move)), [0, 0])
+                entry[0] += 1
+                entry[1] += points[0 if white_to_move else 1]
+                if ply + 1 >= max_plies:
+                    break
+                key = engine.zobrist_key
+                white_to_move = engine.white_to_move
+        except PGNError:
+            continue  # keep the moves read before the error
+
+    entries = sorted((key, move, points) for (key, move), (count, points) in stats.items()
+                     if count >= min_games)
+    # scale the points of each position to fit in 16 bits
+    best = {}
+    for key, _, points in entries:
+        best[key] = max(best.get(key, 0), points)
+
+    with open(path, "wb") as f:
+        for key, move, points in entries:
+            weight = points
+            if best[key] > MAX_WEIGHT:
+                weight = points * MAX_WEIGHT // best[key]
+            f.write(ENTRY.pack(key, move, weight, 0))
+    return len(entries)
+
+
+def check_keys():
+    """Return the moves of the POLYGLOT_KEYS positions whose key differs"""
+    failed = []
+    for moves, key in POLYGLOT_KEYS:
+        engine = ChessEngine()
+        for uci in moves:
+            legal = {Move(move).get_uci(): move for move in engine.get_valid_moves()}
+            engine.make_move(legal[uci])
+        if engine.zobrist_key != key:
+            failed.append(moves)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe a Polyglot opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("book")
+    build.add_argument("--plies", type=int, default=16,
+                       help="number of moves of each game to keep")
+    build.add_argument("--min-games", type=int, default=1,
+                       help="drop moves played in fewer games")
+
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=START_FEN)
+
+    commands.add_parser("check", help="check that keys match the Polyglot ones")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        failed = check_keys()
+        for moves in failed:
+            print(f"wrong key after {' '.join(moves) or 'no moves'}")
+        print(f"{len(POLYGLOT_KEYS) - len(failed)}/{len(POLYGLOT_KEYS)} keys match Polyglot")
+        return 1 if failed else 0
+
+    if args.command == "build":
+        def games():
+            for path in args.pgn:
+                yield from read_games(path)
+
+        count = build_book(games(), args.book, args.plies, args.min_games)
+        print(f"{count} entries written to {args.book}")
+    else:
+        engine = ChessEngine.from_fen(args.fen)
+        with OpeningBook(args.book) as book:
+            moves = book.get_moves(engine)
+        total = sum(weight for _, weight in moves) or 1
+        for move, weight in moves:
+            print(f"{move.get_uci():6} {weight:6} {100 * weight / total:5.1f}%")
+        if not moves:
+            print("position not in book")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
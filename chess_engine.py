@@ -1,12 +1,77 @@
-from moves import Move
+import struct
+from array import array
+
+import zobrist
 from moves import CastlingRights
-from moves import CastlingMove
-from moves import EnPassantMove
+from moves import CASTLING, EN_PASSANT
+from moves import PROMOTION_SHIFT, FLAG_SHIFT, PIECE_SHIFT, CAPTURED_SHIFT
+from bitboard import WHITE, BLACK, EMPTY
+from bitboard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from bitboard import PIECE_NAMES, PIECE_CODES
+from bitboard import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS
+from bitboard import rook_attacks, bishop_attacks, lsb, popcount
+from bitboard import BETWEEN
+from evaluation import MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASE_WEIGHTS
+from evaluation import compute_scores
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# castling rights bits, in the order used by FEN
+WHITE_SHORT = 1
+WHITE_LONG = 2
+BLACK_SHORT = 4
+BLACK_LONG = 8
+ALL_CASTLING = WHITE_SHORT | WHITE_LONG | BLACK_SHORT | BLACK_LONG
+CASTLING_LETTERS = "KQkq"
+
+# rights that survive a move starting or ending on each square
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[0] ^= BLACK_LONG
+CASTLING_MASK[4] ^= BLACK_SHORT | BLACK_LONG
+CASTLING_MASK[7] ^= BLACK_SHORT
+CASTLING_MASK[56] ^= WHITE_LONG
+CASTLING_MASK[60] ^= WHITE_SHORT | WHITE_LONG
+CASTLING_MASK[63] ^= WHITE_SHORT
+
+# rook start and end square for each square the king can castle to
+CASTLING_ROOK_SQUARES = {2: (0, 3), 6: (7, 5), 58: (56, 59), 62: (63, 61)}
+
+NO_SQUARE = 64
+# largest clocks that fit in state_log and in a Position
+MAX_HALFMOVE_CLOCK = (1 << 20) - 1
+MAX_FULLMOVE_NUMBER = 0xFFFF
+
+# stages of ChessEngine.generate_moves
+ALL_MOVES = 0
+CAPTURES = 1
+PROMOTIONS = 2
+QUIETS = 3
+# squares where the pawns of each color promote
+PROMOTION_RANKS = (0xFF, 0xFF << 56)
+
+# Position layout: the piece codes of two squares per byte, the castling
+# rights, en passant square, halfmove clock and side to move packed into
+# one int, the fullmove number and the zobrist key
+POSITION = struct.Struct("<32sIHQ")
+BLACK_TO_MOVE = 1 << 31
+# the two piece codes stored in each board byte
+_NIBBLES = [(byte >> 4, byte & 15) for byte in range(256)]
+
+
+class Position(bytes):
+    """Immutable and hashable snapshot of a ChessEngine position, 46 bytes
+    long, created by ChessEngine.snapshot"""
+
+    __slots__ = ()
+
+    @property
+    def zobrist_key(self):
+        return POSITION.unpack(self)[3]
 
 
 class ChessEngine():
     def __init__(self):
-        self.board = [
+        board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -16,6 +81,25 @@ class ChessEngine():
             ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
         ]
+        # one bitboard per piece code, one occupancy bitboard per color
+        self.bitboards = [0] * 15
+        self.occupied = [0, 0]
+        # piece code on each square, used to find what stands on a square
+        self.squares = [EMPTY] * 64
+        self._board_view = None
+        # checkers and pins shared by the stages of generate_moves
+        self._move_masks = None
+        self.zobrist_key = 0
+        # material plus piece-square scores for white and the game phase,
+        # updated with every piece put on or removed from the board
+        self.middlegame_score = 0
+        self.endgame_score = 0
+        self.phase = 0
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] != "--":
+                    self.put_piece(row * 8 + col, PIECE_CODES[board[row][col]])
+
         self.move_functions = {
             "P": self.get_pawn_moves,
             "N": self.get_knight_moves,
@@ -26,32 +110,301 @@ class ChessEngine():
         }
 
         self.white_to_move = True
-        self.move_log = []
-        self.white_king_pos = (7, 4)
-        self.black_king_pos = (0, 4)
+        # moves are plain ints, see moves.py for the encoding
+        self.move_log = array("I")
+
+        self.castling_rights = ALL_CASTLING
+        # square behind a pawn that has just advanced by 2 squares, only set
+        # when an enemy pawn stands ready to capture it
+        self.en_passant_square = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        # castling rights, en passant square and halfmove clock before each
+        # move in move_log, packed into a single int
+        self.state_log = array("I")
+        # zobrist key before each move in move_log
+        self.key_log = array("Q")
+        self.zobrist_key = zobrist.compute_key(self)
+
+        self.checkmate = False
+        self.stalemate = False
 
+    @classmethod
+    def from_fen(cls, fen):
+        """Create an engine set up in the position described by fen"""
+        engine = cls()
+        engine.set_fen(fen)
+        return engine
+
+    def set_fen(self, fen):
+        """Replace the current position and clear the move history"""
+        fields = fen.split()
+        if len(fields) == 4:
+            fields += ["0", "1"]
+        if len(fields) != 6:
+            raise ValueError(f"expected 6 fields in FEN: {fen!r}")
+        placement, turn, castling, en_passant, halfmove, fullmove = fields
+
+        rows = placement.split("/")
+        if len(rows) != 8:
+            raise ValueError(f"expected 8 rows in FEN: {fen!r}")
+        squares = []
+        for rank in rows:
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend([EMPTY] * int(char))
+                else:
+                    name = ("w" if char.isupper() else "b") + char.upper()
+                    if name not in PIECE_CODES:
+                        raise ValueError(f"invalid piece {char!r} in FEN: {fen!r}")
+                    row.append(PIECE_CODES[name])
+            if len(row) != 8:
+                raise ValueError(f"expected 8 squares per row in FEN: {fen!r}")
+            squares.extend(row)
+        if turn not in ("w", "b"):
+            raise ValueError(f"invalid side to move in FEN: {fen!r}")
+        if not (halfmove.isdigit() and int(halfmove) <= MAX_HALFMOVE_CLOCK):
+            raise ValueError(f"invalid halfmove clock in FEN: {fen!r}")
+        if not (fullmove.isdigit() and 1 <= int(fullmove) <= MAX_FULLMOVE_NUMBER):
+            raise ValueError(f"invalid fullmove number in FEN: {fen!r}")
+        if en_passant != "-" and (len(en_passant) != 2 or en_passant[0] not in "abcdefgh"
+                                  or en_passant[1] != ("6" if turn == "w" else "3")):
+            raise ValueError(f"invalid en passant square in FEN: {fen!r}")
+        if any(piece & 7 == PAWN for piece in squares[:8] + squares[56:]):
+            raise ValueError(f"pawn on the first or last rank in FEN: {fen!r}")
+
+        # everything is checked before the engine changes, so that an
+        # invalid FEN leaves the current position and history in place
+        bitboards = [0] * 15
+        occupied = [0, 0]
+        for sq, piece in enumerate(squares):
+            if piece != EMPTY:
+                bitboards[piece] |= 1 << sq
+                occupied[piece >> 3] |= 1 << sq
+        if (popcount(bitboards[WHITE << 3 | KING]) != 1
+                or popcount(bitboards[BLACK << 3 | KING]) != 1):
+            raise ValueError(f"each side needs exactly one king in FEN: {fen!r}")
+        us = WHITE if turn == "w" else BLACK
+        them = us ^ 1
+        if self.attackers(bitboards[them << 3 | KING].bit_length() - 1, us,
+                          occupied[WHITE] | occupied[BLACK], bitboards):
+            raise ValueError(f"the side not to move is in check in FEN: {fen!r}")
+
+        castling_rights = 0
+        if castling != "-":
+            for char in castling:
+                if char not in CASTLING_LETTERS:
+                    raise ValueError(f"invalid castling rights in FEN: {fen!r}")
+                castling_rights |= 1 << CASTLING_LETTERS.index(char)
+        # drop rights whose king or rook is not on its original square
+        for sq, piece in ((0, "bR"), (4, "bK"), (7, "bR"),
+                          (56, "wR"), (60, "wK"), (63, "wR")):
+            if squares[sq] != PIECE_CODES[piece]:
+                castling_rights &= CASTLING_MASK[sq]
+
+        en_passant_square = None
+        if en_passant != "-":
+            sq = (8 - int(en_passant[1])) * 8 + "abcdefgh".index(en_passant[0])
+            # the pawn that has just advanced by 2 squares stands in front
+            # of the square, which it crossed along with its start square
+            step = 8 if us == WHITE else -8
+            if (squares[sq + step] != (them << 3 | PAWN) or squares[sq] != EMPTY
+                    or squares[sq - step] != EMPTY):
+                raise ValueError(f"invalid en passant square in FEN: {fen!r}")
+            if PAWN_ATTACKS[them][sq] & bitboards[us << 3 | PAWN]:
+                en_passant_square = sq
+
+        self.squares = squares
+        self.bitboards = bitboards
+        self.occupied = occupied
+        self.middlegame_score, self.endgame_score, self.phase = compute_scores(squares)
+        self._board_view = None
+
+        self.white_to_move = us == WHITE
+        self.castling_rights = castling_rights
+        self.en_passant_square = en_passant_square
+        self.halfmove_clock = int(halfmove)
+        self.fullmove_number = int(fullmove)
+        self.move_log = array("I")
+        self.state_log = array("I")
+        self.key_log = array("Q")
+        self.zobrist_key = zobrist.compute_key(self)
         self.checkmate = False
         self.stalemate = False
 
+    @classmethod
+    def from_snapshot(cls, position):
+        """Create an engine set up in a Position"""
+        engine = cls()
+        engine.restore(position)
+        return engine
+
+    def snapshot(self):
+        """Return the current position, without the move history, as an
+        immutable Position"""
+        squares = self.squares
+        en_passant = self.en_passant_square
+        state = (self.castling_rights
+                 | (NO_SQUARE if en_passant is None else en_passant) << 4
+                 | self.halfmove_clock << 11
+                 | (0 if self.white_to_move else BLACK_TO_MOVE))
+        board = bytes([squares[sq] << 4 | squares[sq + 1] for sq in range(0, 64, 2)])
+        return Position(POSITION.pack(board, state, self.fullmove_number, self.zobrist_key))
+
+    def restore(self, position):
+        """Replace the current position with a Position and clear the move
+        history, without the cost of parsing a FEN"""
+        board, state, fullmove, key = POSITION.unpack(position)
+        squares = []
+        for byte in board:
+            squares += _NIBBLES[byte]
+        bitboards = [0] * 15
+        occupied = [0, 0]
+        for sq, piece in enumerate(squares):
+            if piece != EMPTY:
+                bitboards[piece] |= 1 << sq
+                occupied[piece >> 3] |= 1 << sq
+        self.squares = squares
+        self.bitboards = bitboards
+        self.occupied = occupied
+        self.middlegame_score, self.endgame_score, self.phase = compute_scores(squares)
+        self._board_view = None
+
+        self.white_to_move = not state & BLACK_TO_MOVE
+        self.castling_rights = state & 15
+        en_passant = (state >> 4) & 127
+        self.en_passant_square = None if en_passant == NO_SQUARE else en_passant
+        self.halfmove_clock = (state & ~BLACK_TO_MOVE) >> 11
+        self.fullmove_number = fullmove
+        self.zobrist_key = key
+        self.move_log = array("I")
+        self.state_log = array("I")
+        self.key_log = array("Q")
+        self.checkmate = False
+        self.stalemate = False
+
+    def to_fen(self):
+        """Describe the current position in Forsyth-Edwards Notation"""
+        rows = []
+        for row in range(8):
+            rank = ""
+            empty = 0
+            for piece in self.squares[row * 8:row * 8 + 8]:
+                if piece == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                name = PIECE_NAMES[piece]
+                rank += name[1] if name[0] == "w" else name[1].lower()
+            if empty:
+                rank += str(empty)
+            rows.append(rank)
+
+        castling = "".join(letter for n, letter in enumerate(CASTLING_LETTERS)
+                           if self.castling_rights & (1 << n)) or "-"
+        en_passant = "-"
+        if self.en_passant_square is not None:
+            row, col = self.en_passant_square >> 3, self.en_passant_square & 7
+            en_passant = "abcdefgh"[col] + str(8 - row)
+
+        return " ".join(("/".join(rows), "w" if self.white_to_move else "b",
+                         castling, en_passant, str(self.halfmove_clock),
+                         str(self.fullmove_number)))
+
+    @property
+    def board(self):
+        """8x8 grid of piece names derived from the bitboards"""
+        if self._board_view is None:
+            names = [PIECE_NAMES[piece] for piece in self.squares]
+            self._board_view = [names[row * 8:row * 8 + 8] for row in range(8)]
+        return self._board_view
+
+    @property
+    def white_king_pos(self):
+        sq = lsb(self.bitboards[WHITE << 3 | KING])
+        return (sq >> 3, sq & 7)
+
+    @property
+    def black_king_pos(self):
+        sq = lsb(self.bitboards[BLACK << 3 | KING])
+        return (sq >> 3, sq & 7)
+
+    def put_piece(self, sq, piece):
+        bit = 1 << sq
+        self.squares[sq] = piece
+        self.bitboards[piece] |= bit
+        self.occupied[piece >> 3] |= bit
+        self.zobrist_key ^= zobrist.PIECE_KEYS[piece][sq]
+        self.middlegame_score += MIDDLEGAME_SCORES[piece][sq]
+        self.endgame_score += ENDGAME_SCORES[piece][sq]
+        self.phase += PHASE_WEIGHTS[piece & 7]
+        self._board_view = None
+
+    def remove_piece(self, sq):
+        piece = self.squares[sq]
+        if piece != EMPTY:
+            bit = 1 << sq
+            self.squares[sq] = EMPTY
+            self.bitboards[piece] ^= bit
+            self.occupied[piece >> 3] ^= bit
+            self.zobrist_key ^= zobrist.PIECE_KEYS[piece][sq]
+            self.middlegame_score -= MIDDLEGAME_SCORES[piece][sq]
+            self.endgame_score -= ENDGAME_SCORES[piece][sq]
+            self.phase -= PHASE_WEIGHTS[piece & 7]
+            self._board_view = None
+        return piece
+
     def make_move(self, move):
         self.move_log.append(move)
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece
-
-        if move.piece[1] == "K":
-            if isinstance(move, CastlingMove):
-                self.board[move.start_row][move.r_end_col] = move.piece[0] + "R"
-                self.board[move.start_row][move.r_start_col] = "--"
-
-            if move.piece[0] == "w":
-                self.white_king_pos = (move.end_row, move.end_col)
-            elif move.piece[0] == "b":
-                self.black_king_pos = (move.end_row, move.end_col)
-        elif move.piece[1] == "P":
-            if isinstance(move, EnPassantMove):
-                # remove captured pawn
-                self.board[move.captured_row][move.captured_col] = "--"
+        en_passant = self.en_passant_square
+        self.state_log.append(
+            self.castling_rights
+            | (NO_SQUARE if en_passant is None else en_passant) << 4
+            | self.halfmove_clock << 11)
+        self.key_log.append(self.zobrist_key)
+
+        start = move & 63
+        end = move >> 6 & 63
+        flag = move >> FLAG_SHIFT & 3
+        moved = self.remove_piece(start)
+        captured = self.remove_piece(end)
+        promotion = move >> PROMOTION_SHIFT & 7
+        self.put_piece(end, (moved & 8) | promotion if promotion else moved)
+
+        if flag == CASTLING:
+            rook_start, rook_end = CASTLING_ROOK_SQUARES[end]
+            self.put_piece(rook_end, self.remove_piece(rook_start))
+        elif flag == EN_PASSANT:
+            # remove captured pawn, standing next to the start square
+            captured = self.remove_piece((start & ~7) | (end & 7))
+
+        key = self.zobrist_key ^ zobrist.CASTLING_KEYS[self.castling_rights] ^ zobrist.TURN_KEY
+        if en_passant is not None:
+            key ^= zobrist.EN_PASSANT_KEYS[en_passant & 7]
+
+        self.castling_rights &= CASTLING_MASK[start] & CASTLING_MASK[end]
+        key ^= zobrist.CASTLING_KEYS[self.castling_rights]
+        self.en_passant_square = None
+        if moved & 7 == PAWN:
+            self.halfmove_clock = 0
+            if abs(end - start) == 16:
+                # pawn advanced by 2 squares, check for enemy pawns next to it
+                color = moved >> 3
+                passed = (start + end) // 2
+                if PAWN_ATTACKS[color][passed] & self.bitboards[(color ^ 1) << 3 | PAWN]:
+                    self.en_passant_square = passed
+                    key ^= zobrist.EN_PASSANT_KEYS[passed & 7]
+        elif captured != EMPTY:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if not self.white_to_move:
+            self.fullmove_number += 1
 
+        self.zobrist_key = key
         self.white_to_move = not self.white_to_move
 
     def undo_move(self):
@@ -61,79 +414,195 @@ class ChessEngine():
             self.stalemate = False
 
             last_move = self.move_log.pop()
-            self.board[last_move.start_row][last_move.start_col] = last_move.piece
-            self.board[last_move.end_row][last_move.end_col] = last_move.captured
-
-            if last_move.piece[1] == "K":
-                if isinstance(last_move, CastlingMove):
-                    # move rook to original square
-                    self.board[last_move.start_row][last_move.r_end_col] = "--"
-                    self.board[last_move.start_row][last_move.r_start_col] = last_move.piece[0] + "R"
-                if last_move.piece[0] == "w":
-                    self.white_king_pos = (
-                        last_move.start_row, last_move.start_col)
-                else:
-                    self.black_king_pos = (
-                        last_move.start_row, last_move.start_col)
-            elif last_move.piece[1] == "P":
-                if isinstance(last_move, EnPassantMove):
-                    self.board[last_move.captured_row][last_move.captured_col] = last_move.captured
-                    self.board[last_move.end_row][last_move.end_col] = "--"
-            elif last_move.is_promotion:
-                self.board[last_move.start_row][last_move.start_col] = last_move.piece[0] + "P"
+            start = last_move & 63
+            end = last_move >> 6 & 63
+            flag = last_move >> FLAG_SHIFT & 3
+            self.remove_piece(end)
+            self.put_piece(start, last_move >> PIECE_SHIFT & 15)
+
+            captured = last_move >> CAPTURED_SHIFT & 15
+            if flag == CASTLING:
+                # move rook to original square
+                rook_start, rook_end = CASTLING_ROOK_SQUARES[end]
+                self.put_piece(rook_start, self.remove_piece(rook_end))
+            elif flag == EN_PASSANT:
+                self.put_piece((start & ~7) | (end & 7), captured)
+            elif captured != EMPTY:
+                self.put_piece(end, captured)
+
+            state = self.state_log.pop()
+            self.castling_rights = state & 15
+            en_passant = (state >> 4) & 127
+            self.en_passant_square = None if en_passant == NO_SQUARE else en_passant
+            self.halfmove_clock = state >> 11
+            self.zobrist_key = self.key_log.pop()
 
             self.white_to_move = not self.white_to_move
+            if not self.white_to_move:
+                self.fullmove_number -= 1
 
             if self.move_log:
-                return [
-                    (self.move_log[-1].start_row, self.move_log[-1].start_col),
-                    (self.move_log[-1].end_row, self.move_log[-1].end_col)]
+                previous = self.move_log[-1]
+                return [((previous >> 3) & 7, previous & 7),
+                        ((previous >> 9) & 7, (previous >> 6) & 7)]
 
         return []
 
     def get_possible_moves(self):
+        """Return all pseudo-legal moves, ignoring checks, pins and castling"""
         moves = []
-
-        for row in range(8):
-            for col in range(8):
-                piece_color = self.board[row][col][0]
-                if piece_color == ("w" if self.white_to_move else "b"):
-                    piece = self.board[row][col][1]
-                    self.move_functions[piece](moves, row, col, piece_color)
-
-        if self.move_log:
+        us = WHITE if self.white_to_move else BLACK
+        targets = ~self.occupied[us]
+
+        own_pieces = self.occupied[us]
+        while own_pieces:
+            bit = own_pieces & -own_pieces
+            own_pieces ^= bit
+            sq = bit.bit_length() - 1
+            piece = PIECE_NAMES[self.squares[sq]][1]
+            self.move_functions[piece](moves, sq, targets)
+
+        if self.en_passant_square is not None:
             moves.extend(self.get_en_passant_moves())
 
         return moves
 
     def get_valid_moves(self):
-        possible_moves = self.get_possible_moves()
-        # remove invalid moves (checks)
-        for move in reversed(possible_moves):
-            self.make_move(move)
-            if self.enemy_king_nearby(move):
-                possible_moves.remove(move)
-            elif self.king_in_check(move.piece[0]):
-                possible_moves.remove(move)
-            self.undo_move()
-        # add castling moves
-        castling_rights = self.can_castle()
-        king_row = 7 if self.white_to_move else 0
-        if castling_rights.long:
-            possible_moves.append(CastlingMove(
-                [(king_row, 4), (king_row, 2)], self.board, 0))
-        if castling_rights.short:
-            possible_moves.append(CastlingMove(
-                [(king_row, 4), (king_row, 6)], self.board, 7))
-
-        self.is_gameover(possible_moves)
-
-        return possible_moves
+        """Return all legal moves and update checkmate and stalemate"""
+        moves = self.generate_moves(ALL_MOVES)
+        self.is_gameover(moves)
+        return moves
+
+    def generate_moves(self, stage=ALL_MOVES):
+        """Return the legal moves of one stage
+
+        CAPTURES includes en passant and promotions that capture, PROMOTIONS
+        the other promotions and QUIETS every other move, castling included.
+        Checkers and pins are computed once per position, so that every
+        piece only generates moves to the squares it can legally reach.
+        """
+        moves = []
+        us = WHITE if self.white_to_move else BLACK
+        them = us ^ 1
+        own = self.occupied[us]
+        occupied = own | self.occupied[them]
+        king = self.bitboards[us << 3 | KING]
+        king_sq = king.bit_length() - 1
+        checkers, pinned, pin_rays = self.get_move_masks(king_sq, us, occupied)
+        if stage == ALL_MOVES:
+            stage_mask = ~own
+        elif stage == CAPTURES:
+            stage_mask = self.occupied[them]
+        else:
+            stage_mask = ~occupied
+
+        if stage != PROMOTIONS:
+            # the king can go to any square that is not attacked once it has moved
+            king_targets = 0
+            targets = KING_ATTACKS[king_sq] & stage_mask
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                if not self.attackers(bit.bit_length() - 1, them, occupied ^ king):
+                    king_targets |= bit
+            self.get_king_moves(moves, king_sq, king_targets)
+
+        if checkers & (checkers - 1):
+            # double check: only the king can move
+            return moves
+
+        if checkers:
+            # capture the checking piece or block the line of attack
+            check_mask = (checkers | BETWEEN[king_sq][checkers.bit_length() - 1]) & stage_mask
+        else:
+            check_mask = stage_mask
+
+        if stage == PROMOTIONS:
+            own_pieces = self.bitboards[us << 3 | PAWN]
+            check_mask &= PROMOTION_RANKS[us]
+        else:
+            own_pieces = own ^ king
+        while own_pieces:
+            bit = own_pieces & -own_pieces
+            own_pieces ^= bit
+            sq = bit.bit_length() - 1
+            piece = PIECE_NAMES[self.squares[sq]][1]
+            targets = check_mask
+            if stage == QUIETS and piece == "P":
+                targets &= ~PROMOTION_RANKS[us]
+            if bit & pinned:
+                targets &= pin_rays[sq]
+            self.move_functions[piece](moves, sq, targets)
+
+        if self.en_passant_square is not None and stage <= CAPTURES:
+            for move in self.get_en_passant_moves():
+                if self.en_passant_is_legal(move, king_sq, them):
+                    moves.append(move)
+
+        if not checkers and (stage == ALL_MOVES or stage == QUIETS):
+            # add castling moves
+            castling_rights = self.can_castle()
+            castle = king_sq | self.squares[king_sq] << PIECE_SHIFT | CASTLING << FLAG_SHIFT
+            if castling_rights.long:
+                moves.append(castle | (king_sq - 2) << 6)
+            if castling_rights.short:
+                moves.append(castle | (king_sq + 2) << 6)
+
+        return moves
+
+    def get_move_masks(self, king_sq, us, occupied):
+        """Return the checkers, pinned pieces and pin rays of the side to
+        move, computed once for all the stages of a position"""
+        key = (self.zobrist_key, len(self.move_log))
+        masks = self._move_masks
+        if masks is None or masks[0] != key:
+            checkers = self.attackers(king_sq, us ^ 1, occupied)
+            masks = self._move_masks = (key, checkers) + self.get_pins(king_sq, us)
+        return masks[1:]
+
+    def get_pins(self, king_sq, color):
+        """Find the pieces of color pinned to their king
+
+        Return a bitboard of the pinned pieces and a dict mapping each pinned
+        square to the ray it can still move along (pinner included).
+        """
+        enemy = (color ^ 1) << 3
+        bitboards = self.bitboards
+        own = self.occupied[color]
+        enemy_pieces = self.occupied[color ^ 1]
+        queens = bitboards[enemy | QUEEN]
+        # enemy sliders that would attack the king if our pieces were removed
+        snipers = ((rook_attacks(king_sq, enemy_pieces) & (bitboards[enemy | ROOK] | queens))
+                   | (bishop_attacks(king_sq, enemy_pieces) & (bitboards[enemy | BISHOP] | queens)))
+
+        pinned = 0
+        pin_rays = {}
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            ray = BETWEEN[king_sq][bit.bit_length() - 1]
+            blockers = ray & own
+            if blockers and not blockers & (blockers - 1):
+                # exactly one of our pieces stands in between
+                pinned |= blockers
+                pin_rays[blockers.bit_length() - 1] = ray | bit
+        return pinned, pin_rays
+
+    def en_passant_is_legal(self, move, king_sq, enemy):
+        """Check that an en passant capture does not leave the king in check
+
+        Both pawns leave the same rank at once, so the capture can expose the
+        king along that rank even when neither pawn is pinned on its own.
+        """
+        start = 1 << (move & 63)
+        end = 1 << (move >> 6 & 63)
+        captured = 1 << ((move & 56) | (move >> 6 & 7))
+        occupied = ((self.occupied[WHITE] | self.occupied[BLACK]) ^ start ^ captured) | end
+        return not self.attackers(king_sq, enemy, occupied) & ~captured
 
     def is_gameover(self, possible_moves):
         """Check for possible checkmate or stalemate and update stats accordingly"""
         if len(possible_moves) == 0:
-            print("no more moves")
             losing_color = "w" if self.white_to_move else "b"
             if self.king_in_check(losing_color):
                 self.checkmate = True
@@ -145,258 +614,141 @@ class ChessEngine():
 
     def get_en_passant_moves(self):
         moves = []
-        last_move = self.move_log[-1]
-
-        if last_move.piece[1] == "P":
-            if abs(last_move.end_row - last_move.start_row) == 2:
-                # enemy pawn has just advanced by 2 squares
-                enemy_color = last_move.piece[0]
-                color = "b" if enemy_color == "w" else "w"
-                col_directions = (1, -1)
-
-                # check if pawn on horizontally adjacent squares
-                for col_direction in col_directions:
-                    checked_col = last_move.end_col + col_direction
-                    if 0 <= checked_col <= 7:
-                        if self.board[last_move.end_row][checked_col] == color + "P":
-                            end_row = (last_move.end_row +
-                                       last_move.start_row) // 2
-                            move = EnPassantMove(
-                                [(last_move.end_row, checked_col), (end_row, last_move.end_col)], self.board)
-                            moves.append(move)
+        target = self.en_passant_square
+        if target is None:
+            return moves
+
+        us = WHITE if self.white_to_move else BLACK
+        pawn = us << 3 | PAWN
+        # own pawns placed where an enemy pawn would attack the target square
+        pawns = PAWN_ATTACKS[us ^ 1][target] & self.bitboards[pawn]
+        move = (target << 6 | EN_PASSANT << FLAG_SHIFT | pawn << PIECE_SHIFT
+                | (pawn ^ 8) << CAPTURED_SHIFT)
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            moves.append(move | (bit.bit_length() - 1))
 
         return moves
 
     def can_castle(self):
         if self.white_to_move:
-            color = "w"
-            enemy_color = "b"
-            king_pos = self.white_king_pos
-            original_king_pos = (7, 4)
+            long_right, short_right = WHITE_LONG, WHITE_SHORT
+            enemy = BLACK
             row = 7
         else:
-            color = "b"
-            enemy_color = "w"
-            king_pos = self.black_king_pos
-            original_king_pos = (0, 4)
+            long_right, short_right = BLACK_LONG, BLACK_SHORT
+            enemy = WHITE
             row = 0
 
-        if king_pos != original_king_pos:
+        # rights are lost as soon as the king or the rook moves or is captured
+        long = bool(self.castling_rights & long_right)
+        short = bool(self.castling_rights & short_right)
+        if not (long or short):
             return CastlingRights(False, False)
 
-        if self.king_in_check(color):
+        # squares between the king and the rook must be empty (b-d, f-g files)
+        first = row * 8
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        long = long and not occupied >> first & 0b00001110
+        short = short and not occupied >> first & 0b01100000
+        if not (long or short):
             return CastlingRights(False, False)
 
-        long = True
-        short = True
-        # long castle
-        for l in range(1, 4):
-            current_col = king_pos[1] - 1 * l
-            if self.board[row][current_col] == "--":
-                if l < 3:  # check only first 2 square for attacks
-                    if self.square_under_attack(row, current_col, color, enemy_color):
-                        long = False
-                        break
-            else:
-                long = False
-                break
-        # short castle
-        for s in range(1, 3):
-            current_col = king_pos[1] + 1 * s
-            if self.board[row][current_col] == "--":
-                # if square is empty, check for attacks
-                if self.square_under_attack(row, current_col, color, enemy_color):
-                    short = False
-                    break
-            else:
-                short = False
-                break
-        for move in self.move_log:
-            if move.piece == color + "K":
-                return CastlingRights(False, False)
-            if move.piece == color + "R":
-                if move.start_col == 0:
-                    long = False
-                elif move.start_col == 7:
-                    short = False
+        # the king cannot leave, cross or land on an attacked square
+        attackers = self.attackers
+        if attackers(first + 4, enemy, occupied):
+            return CastlingRights(False, False)
+        long = long and not (attackers(first + 3, enemy, occupied)
+                             or attackers(first + 2, enemy, occupied))
+        short = short and not (attackers(first + 5, enemy, occupied)
+                               or attackers(first + 6, enemy, occupied))
 
         return CastlingRights(long, short)
 
-    def enemy_king_nearby(self, move):
-        if move.piece[1] == "K":
-            if move.piece[0] == "b":
-                enemy_king_pos = self.white_king_pos
-            else:
-                enemy_king_pos = self.black_king_pos
-            king_directions = ((1, 0), (-1, 0), (0, 1),
-                               (0, -1), (1, 1), (-1, -1), (-1, 1), (1, -1))
-            for direction in king_directions:
-                checked_row = enemy_king_pos[0] + direction[0]
-                checked_col = enemy_king_pos[1] + direction[1]
-                if checked_row == move.end_row and checked_col == move.end_col:
-                    return True
-        return False
-
     def king_in_check(self, color):
-        if color == "w":
-            king_row = self.white_king_pos[0]
-            king_col = self.white_king_pos[1]
-            enemy_color = "b"
-        else:
-            king_row = self.black_king_pos[0]
-            king_col = self.black_king_pos[1]
-            enemy_color = "w"
-        return self.square_under_attack(king_row, king_col, color, enemy_color)
+        us = WHITE if color == "w" else BLACK
+        king_sq = self.bitboards[us << 3 | KING].bit_length() - 1
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        return self.attackers(king_sq, us ^ 1, occupied) != 0
 
     def square_under_attack(self, row, col, color, enemy_color):
-        # check knights squares
-        knight_moves = ((-1, -2), (-1, 2), (-2, -1), (-2, 1),
-                        (1, -2), (1, 2), (2, -1), (2, 1))
-        for k_move in knight_moves:
-            checked_row = row + k_move[0]
-            checked_col = col + k_move[1]
-            if 0 <= checked_row <= 7 and 0 <= checked_col <= 7:
-                if self.board[checked_row][checked_col] == enemy_color + "N":
-                    return True
-
-        # check pawns
-        for i in [-1, 1]:
-            checked_row = row + (1 if color == "b" else -1)
-            checked_col = col + i
-            if 0 <= checked_row <= 7 and 0 <= checked_col <= 7:
-                if self.board[checked_row][checked_col] == enemy_color + "P":
-                    return True
-
-        # check rows, cols, and diagonals
-        directions = ((1, 0), (-1, 0), (0, 1), (0, -1),
-                      (1, 1), (-1, -1), (-1, 1), (1, -1))
-
-        for direction in directions:
-            n = 1
-            checked_row = row + direction[0]
-            checked_col = col + direction[1]
-
-            while 0 <= checked_row <= 7 and 0 <= checked_col <= 7:
-                square = self.board[checked_row][checked_col]
-
-                if square[0] == color:
-                    # any friendly piece would block possible checks on that direction
-                    break
-                if square[0] == enemy_color:
-                    if square[1] == "Q":
-                        return True
-                    if square[1] == "R" and direction[0] * direction[1] == 0:
-                        return True
-                    if square[1] == "B" and direction[0] * direction[1] != 0:
-                        return True
-                    # any other enemy piece would block possible checks on that direction
-                    break
-
-                n += 1
-                checked_row = row + direction[0] * n
-                checked_col = col + direction[1] * n
-
-        return False
-
-    def get_pawn_moves(self, moves, row, col, color):
-        if color == "w":
-            # check square(s) in front
-            if row-1 >= 0:
-                if self.board[row-1][col] == "--":
-                    # advance by one square
-                    moves.append(Move([(row, col), (row-1, col)], self.board))
-                    if row == 6:
-                        if self.board[row-2][col] == "--":
-                            # advance by two squares
-                            moves.append(
-                                Move([(row, col), (row - 2, col)], self.board))
-            if col+1 <= 7:  # capture to the right
-                if self.board[row-1][col+1][0] == "b":
-                    moves.append(
-                        Move([(row, col), (row-1, col+1)], self.board))
-            if col-1 >= 0:  # capture to the left
-                if self.board[row-1][col-1][0] == "b":
-                    moves.append(
-                        Move([(row, col), (row-1, col-1)], self.board))
+        sq = row * 8 + col
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        return self.attackers(sq, WHITE if enemy_color == "w" else BLACK, occupied) != 0
+
+    def attackers(self, sq, color, occupied, bitboards=None):
+        """Return a bitboard of the pieces of color attacking sq, on the
+        board or on other bitboards"""
+        if bitboards is None:
+            bitboards = self.bitboards
+        base = color << 3
+        queens = bitboards[base | QUEEN]
+        return ((KNIGHT_ATTACKS[sq] & bitboards[base | KNIGHT])
+                | (PAWN_ATTACKS[color ^ 1][sq] & bitboards[base | PAWN])
+                | (KING_ATTACKS[sq] & bitboards[base | KING])
+                | (bishop_attacks(sq, occupied) & (bitboards[base | BISHOP] | queens))
+                | (rook_attacks(sq, occupied) & (bitboards[base | ROOK] | queens)))
+
+    def add_moves(self, moves, sq, targets):
+        """Append a move from sq to every square in targets"""
+        squares = self.squares
+        start = sq | squares[sq] << PIECE_SHIFT
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            moves.append(start | end << 6 | squares[end] << CAPTURED_SHIFT)
+
+    def get_pawn_moves(self, moves, sq, targets):
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        if self.squares[sq] >> 3 == WHITE:
+            us, them, step, start_row, last_row = WHITE, BLACK, -8, 6, 0
         else:
-            if row+1 <= 7:
-                if self.board[row+1][col] == "--":
-                    # advance by one square
-                    moves.append(Move([(row, col), (row+1, col)], self.board))
-                    if row == 1:
-                        if self.board[row+2][col] == "--":
-                            # advance by two squares
-                            moves.append(
-                                Move([(row, col), (row+2, col)], self.board))
-            if col+1 <= 7:  # capture to the right
-                if self.board[row+1][col+1][0] == "w":
-                    moves.append(
-                        Move([(row, col), (row+1, col+1)], self.board))
-            if col-1 >= 0:  # capture to the left
-                if self.board[row+1][col-1][0] == "w":
-                    moves.append(
-                        Move([(row, col), (row+1, col-1)], self.board))
-
-    def get_knight_moves(self, moves, row, col, color):
-        knight_moves = ((-1, -2), (-1, 2), (-2, -1), (-2, 1),
-                        (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knight_moves:
-            new_row = row + m[0]
-            new_col = col + m[1]
-
-            if 0 <= new_row <= 7 and 0 <= new_col <= 7:
-                if self.board[new_row][new_col][0] != color:
-                    moves.append(
-                        Move([(row, col), (new_row, new_col)], self.board))
-
-    def get_bishop_moves(self, moves, row, col, color):
-        directions = ((1, 1), (-1, -1), (-1, 1), (1, -1))
-
-        for direction in directions:
-            n = 1
-            new_row = row + direction[0]
-            new_col = col + direction[1]
-
-            while 0 <= new_col <= 7 and 0 <= new_row <= 7 and self.board[new_row][new_col][0] != color:
-                moves.append(
-                    Move([(row, col), (new_row, new_col)], self.board))
-                if self.board[new_row][new_col] != "--":
-                    break
-
-                n += 1
-                new_row = row + direction[0] * n
-                new_col = col + direction[1] * n
-
-    def get_rook_moves(self, moves, row, col, color):
-        directions = ((1, 0), (-1, 0), (0, 1), (0, -1))
-
-        for direction in directions:
-            n = 1
-            new_row = row + direction[0]
-            new_col = col + direction[1]
-
-            while 0 <= new_col <= 7 and 0 <= new_row <= 7 and self.board[new_row][new_col][0] != color:
-                moves.append(
-                    Move([(row, col), (new_row, new_col)], self.board))
-                if self.board[new_row][new_col] != "--":
-                    break
-
-                n += 1
-                new_row = row + direction[0] * n
-                new_col = col + direction[1] * n
-
-    def get_queen_moves(self, moves, row, col, color):
-        self.get_bishop_moves(moves, row, col, color)
-        self.get_rook_moves(moves, row, col, color)
-
-    def get_king_moves(self, moves, row, col, color):
-        directions = ((1, 1), (1, 0), (1, -1), (0, -1),
-                      (-1, -1), (-1, 0), (-1, 1), (0, 1))
-        for direction in directions:
-            new_row = row + direction[0]
-            new_col = col + direction[1]
-
-            if 0 <= new_col <= 7 and 0 <= new_row <= 7:
-                if self.board[new_row][new_col][0] != color:
-                    moves.append(
-                        Move([(row, col), (new_row, new_col)], self.board))
+            us, them, step, start_row, last_row = BLACK, WHITE, 8, 1, 7
+
+        # check square(s) in front
+        reachable = 0
+        if not occupied & (1 << (sq + step)):
+            # advance by one square
+            reachable |= 1 << (sq + step)
+            if sq >> 3 == start_row and not occupied & (1 << (sq + 2 * step)):
+                # advance by two squares
+                reachable |= 1 << (sq + 2 * step)
+        # captures
+        reachable |= PAWN_ATTACKS[us][sq] & self.occupied[them]
+        reachable &= targets
+
+        if (sq + step) >> 3 != last_row:
+            self.add_moves(moves, sq, reachable)
+            return
+
+        # promotion: one move for each piece the pawn can become
+        squares = self.squares
+        start = sq | squares[sq] << PIECE_SHIFT
+        while reachable:
+            bit = reachable & -reachable
+            reachable ^= bit
+            end = bit.bit_length() - 1
+            move = start | end << 6 | squares[end] << CAPTURED_SHIFT
+            for piece in (QUEEN, ROOK, BISHOP, KNIGHT):
+                moves.append(move | piece << PROMOTION_SHIFT)
+
+    def get_knight_moves(self, moves, sq, targets):
+        self.add_moves(moves, sq, KNIGHT_ATTACKS[sq] & targets)
+
+    def get_bishop_moves(self, moves, sq, targets):
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        self.add_moves(moves, sq, bishop_attacks(sq, occupied) & targets)
+
+    def get_rook_moves(self, moves, sq, targets):
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        self.add_moves(moves, sq, rook_attacks(sq, occupied) & targets)
+
+    def get_queen_moves(self, moves, sq, targets):
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        self.add_moves(moves, sq, (rook_attacks(sq, occupied)
+                                   | bishop_attacks(sq, occupied)) & targets)
+
+    def get_king_moves(self, moves, sq, targets):
+        self.add_moves(moves, sq, KING_ATTACKS[sq] & targets)
@@ -0,0 +1,115 @@
+"""Module containing the binary encoding of positions and NumPy converters
+for many positions at once
+
+A position is encoded as the 46 bytes of a chess_engine.Position: the
+piece codes of two squares per byte, a 32 bit state (castling rights, en
+passant square, halfmove clock and side to move), the fullmove number and
+the zobrist key, little endian. Positions stored back to back in one
+buffer are read by NumPy as an array of POSITION_DTYPE without a copy.
+
+Usage:
+    data = encode_many(engines)
+    positions = to_array(data)
+    boards = boards_from_array(positions)     # (N, 64) int8, as batch_evaluation
+    engine = decode(data[:POSITION_SIZE])
+
+Functions:
+    encode
+    decode
+    encode_many
+    decode_many
+    to_array
+    boards_from_array
+    state_from_array
+    array_from_boards
+"""
+import numpy as np
+
+import zobrist
+from chess_engine import ChessEngine, Position
+from chess_engine import POSITION, BLACK_TO_MOVE, NO_SQUARE
+
+POSITION_SIZE = POSITION.size
+POSITION_FIELDS = [("board", "u1", (32,)), ("state", "<u4"), ("fullmove", "<u2"),
+                   ("key", "<u8")]
+POSITION_DTYPE = np.dtype(POSITION_FIELDS)
+
+
+def encode(engine):
+    """Return the position of engine as a 46 byte Position"""
+    return engine.snapshot()
+
+
+def decode(data, engine=None):
+    """Set up engine, or a new ChessEngine, in an encoded position and
+    return it"""
+    if engine is None:
+        return ChessEngine.from_snapshot(Position(data))
+    engine.restore(Position(data))
+    return engine
+
+
+def encode_many(positions):
+    """Return engines or Positions encoded back to back in one bytes"""
+    return b"".join(position.snapshot() if isinstance(position, ChessEngine) else position
+                    for position in positions)
+
+
+def decode_many(data):
+    """Return the list of Positions stored in a buffer"""
+    data = bytes(data)
+    return [Position(data[start:start + POSITION_SIZE])
+            for start in range(0, len(data), POSITION_SIZE)]
+
+
+def to_array(data):
+    """Return a buffer of encoded positions as an array of POSITION_DTYPE,
+    sharing its memory; array.tobytes() gives the buffer back"""
+    return np.frombuffer(data, dtype=POSITION_DTYPE)
+
+
+def boards_from_array(positions):
+    """Return an (N, 64) int8 array of piece codes"""
+    board = positions["board"]
+    return np.stack([board >> 4, board & 15], axis=-1).reshape(len(positions), 64).astype(np.int8)
+
+
+def state_from_array(positions):
+    """Return the side to move (True for white), castling rights, en passant
+    square (NO_SQUARE when there is none) and halfmove clock arrays"""
+    state = positions["state"]
+    return ((state & BLACK_TO_MOVE) == 0, state & 15, (state >> 4) & 127,
+            (state & ~np.uint32(BLACK_TO_MOVE)) >> 11)
+
+
+def array_from_boards(boards, white_to_move, castling=0, en_passant=NO_SQUARE,
+                      halfmove=0, fullmove=1):
+    """Encode (N, 64) boards of piece codes and their state as an array of
+    POSITION_DTYPE, zobrist keys included
+
+    The state arguments are arrays or single values for every board. An
+    en passant square is only kept by the engine when a pawn can take on it.
+    """
+    boards = np.asarray(boards, dtype=np.uint8)
+    count = len(boards)
+    white_to_move = np.broadcast_to(np.asarray(white_to_move, dtype=bool), count)
+    castling = np.broadcast_to(np.asarray(castling, dtype=np.uint32), count)
+    en_passant = np.broadcast_to(np.asarray(en_passant, dtype=np.uint32), count)
+    halfmove = np.broadcast_to(np.asarray(halfmove, dtype=np.uint32), count)
+
+    positions = np.zeros(count, dtype=POSITION_DTYPE)
+    positions["board"] = boards[:, 0::2] << 4 | boards[:, 1::2]
+    positions["state"] = (castling | en_passant << 4 | halfmove << 11
+                          | np.where(white_to_move, 0, BLACK_TO_MOVE).astype(np.uint32))
+    positions["fullmove"] = fullmove
+
+    # zobrist.compute_key for every board; tables are read now, since
+    # zobrist.set_random_table can replace them
+    piece_keys = np.array(zobrist.PIECE_KEYS, dtype=np.uint64)
+    keys = np.bitwise_xor.reduce(piece_keys[boards, np.arange(64)], axis=1)
+    keys ^= np.array(zobrist.CASTLING_KEYS, dtype=np.uint64)[castling]
+    en_passant_keys = np.array(zobrist.EN_PASSANT_KEYS, dtype=np.uint64)[en_passant & 7]
+    keys ^= np.where(en_passant != NO_SQUARE, en_passant_keys, np.uint64(0))
+    keys ^= np.where(white_to_move, np.uint64(zobrist.TURN_KEY), np.uint64(0))
+    positions["key"] = keys
+    return positions
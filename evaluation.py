@@ -0,0 +1,130 @@
+"""Module containing the static evaluation used by the search
+
+Scores are in centipawns. Piece-square tables come from the "Simplified
+Evaluation Function" and are written from white's point of view with rank
+8 on top, the same layout as ChessEngine.board. Middlegame and endgame
+scores only differ for the king and are blended by the amount of material
+left on the board (tapered evaluation).
+
+ChessEngine keeps the middlegame and endgame sums and the phase up to
+date as pieces move, so evaluate does not look at the board.
+"""
+from bitboard import WHITE, BLACK, EMPTY
+from bitboard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+
+PIECE_VALUES = [0, 100, 320, 330, 500, 900, 0]
+
+# contribution of each piece type to the game phase, 24 at the start
+PHASE_WEIGHTS = [0, 0, 1, 1, 2, 4, 0]
+TOTAL_PHASE = 24
+
+PAWN_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+]
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+]
+ROOK_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+]
+QUEEN_TABLE = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+]
+KING_MIDDLEGAME_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+]
+KING_ENDGAME_TABLE = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+]
+
+
+def _score_tables(king_table):
+    """Return piece value plus square bonus for each piece code and square,
+    positive for white pieces and negative for black ones"""
+    tables = [[0] * 64 for _ in range(15)]
+    for kind, table in ((PAWN, PAWN_TABLE), (KNIGHT, KNIGHT_TABLE),
+                        (BISHOP, BISHOP_TABLE), (ROOK, ROOK_TABLE),
+                        (QUEEN, QUEEN_TABLE), (KING, king_table)):
+        for sq in range(64):
+            tables[WHITE << 3 | kind][sq] = PIECE_VALUES[kind] + table[sq]
+            # mirror the board vertically for black
+            tables[BLACK << 3 | kind][sq] = -(PIECE_VALUES[kind] + table[sq ^ 56])
+    return tables
+
+
+MIDDLEGAME_SCORES = _score_tables(KING_MIDDLEGAME_TABLE)
+ENDGAME_SCORES = _score_tables(KING_ENDGAME_TABLE)
+
+
+def compute_scores(squares):
+    """Return the middlegame score, endgame score and phase of a list of
+    64 piece codes, from scratch"""
+    middlegame = 0
+    endgame = 0
+    phase = 0
+    for sq, piece in enumerate(squares):
+        if piece != EMPTY:
+            middlegame += MIDDLEGAME_SCORES[piece][sq]
+            endgame += ENDGAME_SCORES[piece][sq]
+            phase += PHASE_WEIGHTS[piece & 7]
+    return middlegame, endgame, phase
+
+
+def evaluate(engine):
+    """Return the score of the position for the side to move"""
+    phase = min(engine.phase, TOTAL_PHASE)
+    score = (engine.middlegame_score * phase
+             + engine.endgame_score * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+    return score if engine.white_to_move else -score
@@ -0,0 +1,311 @@
+"""Module containing a game database indexed by position
+
+Every position reached in a game is stored as a fixed size record (zobrist
+key, game id, ply, result, move played next) in a file sorted by key. A
+position is looked up by binary search through mmap, and all the games
+that reached it are stored next to each other, so queries only read the
+records they return.
+
+New games are sorted in memory and written as runs, which are merged into
+the index by commit. Game headers are kept in a JSON lines file.
+
+Usage:
+    python gamedb.py add games.db games.pgn.gz
+    python gamedb.py query games.db --moves e2e4 e7e5
+
+Classes:
+    GameDatabase
+    PositionStats
+"""
+import argparse
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import Counter
+
+from chess_engine import ChessEngine
+from chess_engine import START_FEN
+from moves import Move
+from pgn import read_games, replay, PGNError
+from results import WHITE_WINS, DRAW, BLACK_WINS, UNKNOWN, RESULT_CODES
+
+# key, game id, ply, next move, result; big endian so that records sort
+# the same way as bytes and as numbers, and the records of one game
+# through a position in the order it reached it
+RECORD = struct.Struct(">QIHIbx")
+KEY = struct.Struct(">Q")
+
+# records sorted in memory before they are written as a run
+RUN_SIZE = 1 << 20
+
+INDEX_FILE = "positions.bin"
+HEADERS_FILE = "games.jsonl"
+OFFSETS_FILE = "games.idx"
+RUN_PREFIX = "run-"
+
+
+class PositionStats():
+    """Class used to store what happened in the games through a position"""
+
+    def __init__(self):
+        self.games = 0
+        self.white_wins = 0
+        self.draws = 0
+        self.black_wins = 0
+        # move played next -> number of games
+        self.next_moves = Counter()
+
+    def __repr__(self):
+        moves = ", ".join(f"{Move(move).get_uci()} {count}"
+                          for move, count in self.next_moves.most_common(5))
+        return (f"{self.games} games +{self.white_wins} ={self.draws} "
+                f"-{self.black_wins} next: {moves}")
+
+
+class GameDatabase():
+    """Class used to store games and find the games through a position"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.pending = []
+        self.runs = sorted(name for name in os.listdir(directory) if name.startswith(RUN_PREFIX))
+
+        self.offsets = array("Q")
+        offsets_path = os.path.join(directory, OFFSETS_FILE)
+        if os.path.exists(offsets_path):
+            with open(offsets_path, "rb") as f:
+                self.offsets.frombytes(f.read())
+        self.headers_file = open(os.path.join(directory, HEADERS_FILE), "a+b")
+        self.offsets_file = open(offsets_path, "ab")
+
+        self.index_file = None
+        self.data = b""
+        self.size = 0
+        self.open_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        self.commit()
+        self.close_index()
+        self.headers_file.close()
+        self.offsets_file.close()
+
+    def open_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return
+        self.index_file = open(path, "rb")
+        self.data = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.data) // RECORD.size
+
+    def close_index(self):
+        if self.index_file is not None:
+            self.data.close()
+            self.index_file.close()
+        self.index_file = None
+        self.data = b""
+        self.size = 0
+
+    def add_game(self, game, trusted=True):
+        """Store a pgn.PGNGame and return its id
+
+        The moves up to an illegal one are kept. Games are only visible to
+        queries after commit.
+        """
+        game_id = len(self.offsets)
+        result = RESULT_CODES.get(game.result, UNKNOWN)
+        engine = game.start_engine()
+        key = engine.zobrist_key
+        ply = 0
+        try:
+            for move in replay(game, engine, trusted):
+                self.pending.append((key, game_id, ply, move, result))
+                key = engine.zobrist_key
+                ply += 1
+        except PGNError:
+            pass
+        self.pending.append((key, game_id, ply, 0, result))
+
+        self.headers_file.seek(0, 2)
+        self.offsets.append(self.headers_file.tell())
+        self.offsets_file.write(self.offsets[-1:].tobytes())
+        headers = dict(game.headers, Result=game.result, PlyCount=str(ply))
+        self.headers_file.write(json.dumps(headers).encode() + b"\n")
+
+        if len(self.pending) >= RUN_SIZE:
+            self.write_run()
+        return game_id
+
+    def add_games(self, games, trusted=True):
+        """Store many games and commit them, returning how many were added"""
+        count = 0
+        for game in games:
+            self.add_game(game, trusted)
+            count += 1
+        self.commit()
+        return count
+
+    def write_run(self):
+        """Sort the pending records and write them to a new run file"""
+        if not self.pending:
+            return
+        self.pending.sort()
+        name = f"{RUN_PREFIX}{len(self.runs):06d}.bin"
+        with open(os.path.join(self.directory, name), "wb") as f:
+            for record in self.pending:
+                f.write(RECORD.pack(*record))
+        self.runs.append(name)
+        self.pending = []
+
+    def commit(self):
+        """Merge the new games into the index"""
+        self.write_run()
+        self.headers_file.flush()
+        self.offsets_file.flush()
+        if not self.runs:
+            return
+
+        sources = [os.path.join(self.directory, name) for name in self.runs]
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            sources.append(index_path)
+        files = [open(path, "rb") for path in sources]
+        temporary = index_path + ".tmp"
+        with open(temporary, "wb") as out:
+            for record in heapq.merge(*(read_records(f) for f in files)):
+                out.write(record)
+        for f in files:
+            f.close()
+
+        self.close_index()
+        os.replace(temporary, index_path)
+        for name in self.runs:
+            os.remove(os.path.join(self.directory, name))
+        self.runs = []
+        self.open_index()
+
+    def find(self, key):
+        """Return the position in the index of the first record of key"""
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, key):
+        """Yield the (game id, next move, ply, result) of every record of key"""
+        start = self.find(key) * RECORD.size
+        end = self.find(key + 1) * RECORD.size if key < (1 << 64) - 1 else len(self.data)
+        for _, game_id, ply, move, result in RECORD.iter_unpack(self.data[start:end]):
+            yield game_id, move, ply, result
+
+    def games(self, engine):
+        """Return the (game id, ply) of every game through the position of
+        engine"""
+        return [(game_id, ply) for game_id, _, ply, _ in self.records(engine.zobrist_key)]
+
+    def stats(self, engine):
+        """Return the PositionStats of the position of engine
+
+        A game that goes through the position more than once is counted
+        once, with the move it played the first time.
+        """
+        stats = PositionStats()
+        seen = set()
+        for game_id, move, _, result in self.records(engine.zobrist_key):
+            if game_id in seen:
+                continue
+            seen.add(game_id)
+            stats.games += 1
+            if result == WHITE_WINS:
+                stats.white_wins += 1
+            elif result == DRAW:
+                stats.draws += 1
+            elif result == BLACK_WINS:
+                stats.black_wins += 1
+            if move:
+                stats.next_moves[move] += 1
+        return stats
+
+    def headers(self, game_id):
+        """Return the PGN headers of a game"""
+        self.headers_file.flush()
+        self.headers_file.seek(self.offsets[game_id])
+        return json.loads(self.headers_file.readline())
+
+
+def read_records(f, chunk=RECORD.size * 4096):
+    """Yield the raw records of a sorted file, in order"""
+    while True:
+        data = f.read(chunk)
+        if not data:
+            return
+        for i in range(0, len(data), RECORD.size):
+            yield data[i:i + RECORD.size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Store games and query them by position")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add the games of PGN files")
+    add.add_argument("database")
+    add.add_argument("pgn", nargs="+")
+
+    query = commands.add_parser("query", help="show the games through a position")
+    query.add_argument("database")
+    query.add_argument("--fen", default=START_FEN)
+    query.add_argument("--moves", nargs="*", default=[],
+                       help="moves played from the FEN, such as e2e4 e7e5")
+    query.add_argument("--list", type=int, default=10,
+                       help="number of games to list")
+    args = parser.parse_args(argv)
+
+    with GameDatabase(args.database) as database:
+        if args.command == "add":
+            start_time = time.perf_counter()
+            count = 0
+            for path in args.pgn:
+                count += database.add_games(read_games(path))
+            print(f"{count} games added in {time.perf_counter() - start_time:.1f} s, "
+                  f"{len(database)} games in the database")
+            return 0
+
+        engine = ChessEngine.from_fen(args.fen)
+        for uci in args.moves:
+            legal = {Move(move).get_uci(): move for move in engine.get_valid_moves()}
+            if uci not in legal:
+                print(f"illegal move {uci}")
+                return 1
+            engine.make_move(legal[uci])
+
+        start_time = time.perf_counter()
+        stats = database.stats(engine)
+        elapsed = time.perf_counter() - start_time
+        print(f"{stats} ({elapsed * 1000:.1f} ms)")
+        for game_id, ply in database.games(engine)[:args.list]:
+            headers = database.headers(game_id)
+            print(f"#{game_id} ply {ply}: {headers.get('White', '?')} - "
+                  f"{headers.get('Black', '?')} {headers.get('Result', '*')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Module containing a move history with redo, jumps and variations
+
+Each line of play keeps its moves, the zobrist key before each move and a
+Position snapshot every interval plies. Any ply is reached by restoring
+the checkpoint at or before it and replaying fewer than interval moves, or
+by playing or undoing a few moves when the target is close. Playing a move
+that differs from the next move of the line starts a variation, a new line
+sharing the moves and checkpoints before the branch.
+
+Usage:
+    history = GameHistory(engine)
+    history.play(move)          # instead of engine.make_move
+    history.undo()
+    history.redo()
+    history.jump(10)
+
+Classes:
+    Line
+    GameHistory
+"""
+from array import array
+
+
+class Line():
+    """Class used to store one line of play from the start of the game"""
+
+    def __init__(self, moves, keys, checkpoints, parent=None, branch_ply=0):
+        self.moves = moves
+        # zobrist key before each move, for repetition checks after a jump
+        self.keys = keys
+        # snapshots at plies 0, interval, 2 * interval...
+        self.checkpoints = checkpoints
+        self.parent = parent
+        self.branch_ply = branch_ply
+
+    def __len__(self):
+        return len(self.moves)
+
+
+class GameHistory():
+    """Class used to move through the moves and variations of a game
+    played on engine, starting from its current position"""
+
+    def __init__(self, engine, interval=16):
+        self.engine = engine
+        self.interval = interval
+        self.line = Line(array("I"), array("Q"), [engine.snapshot()])
+        self.lines = [self.line]
+        self.ply = 0
+
+    def __len__(self):
+        return len(self.line)
+
+    def play(self, move):
+        """Make a move, following the current line or a variation that
+        already has it, or starting a new variation"""
+        line = self.line
+        ply = self.ply
+        if ply < len(line) and line.moves[ply] != move:
+            for other in self.lines:
+                if (len(other) > ply and other.moves[ply] == move
+                        and other.moves[:ply] == line.moves[:ply]):
+                    line = other
+                    break
+            else:
+                line = Line(line.moves[:ply], line.keys[:ply],
+                            line.checkpoints[:ply // self.interval + 1], line, ply)
+                self.lines.append(line)
+            self.line = line
+
+        key = self.engine.zobrist_key
+        self.engine.make_move(move)
+        self.ply += 1
+        if ply == len(line):
+            line.moves.append(move)
+            line.keys.append(key)
+            if self.ply % self.interval == 0:
+                line.checkpoints.append(self.engine.snapshot())
+
+    def undo(self):
+        """Go back one move, returning False at the start of the game"""
+        if not self.ply:
+            return False
+        self.jump(self.ply - 1)
+        return True
+
+    def redo(self):
+        """Play the next move of the current line again, returning False at
+        its end"""
+        if self.ply >= len(self.line):
+            return False
+        self.engine.make_move(self.line.moves[self.ply])
+        self.ply += 1
+        return True
+
+    def jump(self, ply):
+        """Set the engine to a ply of the current line"""
+        engine = self.engine
+        line = self.line
+        ply = max(0, min(ply, len(line)))
+        if 0 <= ply - self.ply < self.interval:
+            for move in line.moves[self.ply:ply]:
+                engine.make_move(move)
+        elif 0 < self.ply - ply <= min(len(engine.move_log), self.interval):
+            for _ in range(self.ply - ply):
+                engine.undo_move()
+        else:
+            checkpoint = ply // self.interval * self.interval
+            engine.restore(line.checkpoints[ply // self.interval])
+            # keys since the last capture or pawn move, for repetitions
+            engine.key_log.extend(line.keys[max(checkpoint - engine.halfmove_clock, 0):checkpoint])
+            for move in line.moves[checkpoint:ply]:
+                engine.make_move(move)
+        self.ply = ply
+
+    def select_line(self, line):
+        """Switch to another line, at the current ply if both lines share
+        the moves before it, else where they part"""
+        ply = 0
+        while ply < min(self.ply, len(line)) and line.moves[ply] == self.line.moves[ply]:
+            ply += 1
+        self.jump(ply)
+        self.line = line
+
+    def next_moves(self):
+        """Return the moves played from the current position in any line,
+        the move of the current line first"""
+        moves = []
+        prefix = self.line.moves[:self.ply]
+        for line in [self.line] + self.lines:
+            if len(line) > self.ply and line.moves[self.ply] not in moves \
+                    and line.moves[:self.ply] == prefix:
+                moves.append(line.moves[self.ply])
+        return moves
+
+    def last_move_squares(self):
+        """Return the (row, col) of the start and end squares of the move
+        that led to the current position, or an empty list"""
+        if not self.ply:
+            return []
+        move = self.line.moves[self.ply - 1]
+        return [((move >> 3) & 7, move & 7), ((move >> 9) & 7, (move >> 6) & 7)]
@@ -0,0 +1,240 @@
+"""Module containing opt-in call counters and timers for ChessEngine
+
+enable() replaces the hot methods of ChessEngine with wrappers that count
+and time every call, and disable() puts the original methods back, so the
+engine runs at full speed unless instrumentation is on. Engines created
+before enable() keep their original per-piece move functions.
+
+Any script can be run with the counters, cProfile or a sampling profiler:
+    python instrumentation.py perft.py 4
+    python instrumentation.py --json stats.json search.py --depth 5
+    python instrumentation.py --profile out.prof --sample search.py --time 5
+
+Classes:
+    Sampler
+
+Functions:
+    enable
+    disable
+    is_enabled
+    reset
+    stats
+    export_json
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import runpy
+import sys
+import threading
+import time
+from collections import Counter
+
+from chess_engine import ChessEngine
+from moves import CASTLING, FLAG_SHIFT
+
+INSTRUMENTED_METHODS = (
+    "get_possible_moves", "get_valid_moves", "generate_moves", "make_move", "undo_move",
+    "square_under_attack", "king_in_check", "attackers",
+    "get_pawn_moves", "get_knight_moves", "get_bishop_moves",
+    "get_rook_moves", "get_queen_moves", "get_king_moves",
+)
+
+# method name -> [calls, total nanoseconds]
+_calls = {}
+_counters = Counter()
+_originals = {}
+# set while the pruned move count is measured, so it is not counted twice
+_paused = False
+
+
+def _timed(name, method):
+    entry = _calls.setdefault(name, [0, 0])
+    perf_counter_ns = time.perf_counter_ns
+
+    def wrapper(*args, **kwargs):
+        if _paused:
+            return method(*args, **kwargs)
+        start = perf_counter_ns()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            entry[0] += 1
+            entry[1] += perf_counter_ns() - start
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def _counted_valid_moves(method, count_pruned):
+    def get_valid_moves(self):
+        global _paused
+        moves = method(self)
+        _counters["legal_moves"] += len(moves)
+        if count_pruned and not _paused:
+            # pseudo-legal moves that the legal generator never produced
+            _paused = True
+            try:
+                pseudo_legal = len(self.get_possible_moves())
+            finally:
+                _paused = False
+            castling = sum(1 for move in moves if move >> FLAG_SHIFT & 3 == CASTLING)
+            _counters["pseudo_legal_moves"] += pseudo_legal + castling
+            _counters["pruned_moves"] += pseudo_legal + castling - len(moves)
+        return moves
+
+    get_valid_moves.__doc__ = method.__doc__
+    return get_valid_moves
+
+
+def enable(count_pruned=False):
+    """Start counting and timing the calls of every ChessEngine
+
+    With count_pruned=True every get_valid_moves call also generates the
+    pseudo-legal moves, to count how many of them are illegal. This makes
+    the program slower, but not the recorded get_valid_moves time.
+    """
+    if _originals:
+        disable()
+    for name in INSTRUMENTED_METHODS:
+        method = ChessEngine.__dict__[name]
+        _originals[name] = method
+        method = _timed(name, method)
+        if name == "get_valid_moves":
+            # counted outside the timer, so that the pseudo-legal moves
+            # generated for count_pruned are not in its time
+            method = _counted_valid_moves(method, count_pruned)
+        setattr(ChessEngine, name, method)
+
+
+def disable():
+    """Put the original ChessEngine methods back"""
+    for name, method in _originals.items():
+        setattr(ChessEngine, name, method)
+    _originals.clear()
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+def reset():
+    """Clear the counters and timers"""
+    for entry in _calls.values():
+        entry[0] = entry[1] = 0
+    _counters.clear()
+
+
+def stats():
+    """Return the counters and the calls, total and mean time of every
+    instrumented method"""
+    methods = {}
+    for name, (calls, total) in sorted(_calls.items(), key=lambda item: -item[1][1]):
+        if calls:
+            methods[name] = {"calls": calls, "total_ms": total / 1e6,
+                             "mean_us": total / calls / 1e3}
+    return {"methods": methods, "counters": dict(_counters)}
+
+
+def export_json(path):
+    """Write stats() to a JSON file"""
+    with open(path, "w") as f:
+        json.dump(stats(), f, indent=2)
+
+
+def format_stats(result=None):
+    """Return stats() as a text table"""
+    result = result or stats()
+    lines = [f"{'method':22}{'calls':>12}{'total ms':>12}{'mean us':>10}"]
+    for name, entry in result["methods"].items():
+        lines.append(f"{name:22}{entry['calls']:12}{entry['total_ms']:12.1f}"
+                     f"{entry['mean_us']:10.2f}")
+    for name, value in result["counters"].items():
+        lines.append(f"{name:22}{value:12}")
+    return "\n".join(lines)
+
+
+class Sampler():
+    """Class used to sample the running function of a thread at a fixed
+    interval, a profiler with a low and constant overhead"""
+
+    def __init__(self, interval=0.001, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.samples
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                code = frame.f_code
+                self.samples[f"{os.path.basename(code.co_filename)}:{code.co_name}"] += 1
+
+    def report(self, top=15):
+        total = sum(self.samples.values()) or 1
+        return "\n".join(f"{100 * count / total:6.1f}%  {name}"
+                         for name, count in self.samples.most_common(top))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a script with ChessEngine instrumentation")
+    parser.add_argument("--json", default=None, help="write the stats to this file")
+    parser.add_argument("--pruned", action="store_true",
+                        help="count pseudo-legal moves pruned as illegal")
+    parser.add_argument("--profile", default=None,
+                        help="run under cProfile and save the profile to this file")
+    parser.add_argument("--sample", action="store_true",
+                        help="report the functions seen by a sampling profiler")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    enable(count_pruned=args.pruned)
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    profiler = cProfile.Profile() if args.profile else None
+    sampler = Sampler().start() if args.sample else None
+    # exit code of the script, passed on once the stats are printed
+    exit_code = 0
+    try:
+        if profiler is not None:
+            profiler.enable()
+        runpy.run_path(args.script, run_name="__main__")
+    except SystemExit as error:
+        exit_code = error.code
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if sampler is not None:
+            sampler.stop()
+        disable()
+
+    print(format_stats(), file=sys.stderr)
+    if args.json:
+        export_json(args.json)
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("tottime").print_stats(15)
+    if sampler is not None:
+        print(sampler.report(), file=sys.stderr)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,49 +3,120 @@ import pygame
 
 from chess_engine import ChessEngine
 from scoreboard import Scoreboard
+from renderer import BoardRenderer, EvalBar
+from analysis import AnalysisWorker
+from history import GameHistory
+from moves import Move
+from search import MATE_SCORE, MAX_PLY
 import program_functions as pf
-from settings import BOARD_SIZE
+from settings import BOARD_SIZE, EVAL_BAR_WIDTH
+
+ANALYSIS_EVENT = pygame.USEREVENT + 1
+# plies skipped by page up and page down
+PAGE_PLIES = 10
+
+
+def show_analysis(eval_bar, info):
+    if abs(info.score) >= MATE_SCORE - MAX_PLY:
+        plies = MATE_SCORE - abs(info.score)
+        score = f"{'' if info.score > 0 else '-'}M{(plies + 1) // 2}"
+    else:
+        score = f"{info.score / 100:+.2f}"
+    pygame.display.set_caption(
+        f"depth {info.depth}  {score}  {Move(info.best_move).get_uci()}")
+    eval_bar.draw(info.score)
+
+
+def show_game_over(eval_bar, scoreboard, engine):
+    # the analysis sends nothing once the game is over
+    if engine.checkmate:
+        pygame.display.set_caption("checkmate")
+        eval_bar.draw(-MATE_SCORE if engine.white_to_move else MATE_SCORE)
+    else:
+        pygame.display.set_caption("stalemate")
+        eval_bar.draw(0)
+    scoreboard.show_text()
 
 
 def main():
+    # start the analysis process before pygame, so that it does not inherit it
+    analysis = AnalysisWorker(
+        notify=lambda: pygame.event.post(pygame.event.Event(ANALYSIS_EVENT))).start()
+
     pygame.init()
-    window = pygame.display.set_mode((BOARD_SIZE, BOARD_SIZE))
+    window = pygame.display.set_mode((BOARD_SIZE + EVAL_BAR_WIDTH, BOARD_SIZE))
     images = pf.load_pieces()
+    renderer = BoardRenderer(window, images)
+    eval_bar = EvalBar(window)
 
     ######################################
 
     chess_engine = ChessEngine()
+    history = GameHistory(chess_engine)
     scoreboard = Scoreboard(chess_engine, window)
 
     coordinates = []
     valid_moves = chess_engine.get_valid_moves()
 
-    pf.draw_board(window, images, chess_engine.board,
-                  coordinates, valid_moves)
+    renderer.draw(chess_engine.board, coordinates, valid_moves)
+    eval_bar.draw()
+    analysis.analyse(chess_engine)
 
     while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                sys.exit()
-
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_LEFT:
-                    # undo last move
-                    coord = chess_engine.undo_move()
-                    # calculate new valid moves
-                    valid_moves = chess_engine.get_valid_moves()
-                    pf.draw_board(window, images,
-                                  chess_engine.board, coord, valid_moves)
-
-            if valid_moves:
-                if pygame.mouse.get_pressed()[0]:
-                    pf.move_pieces(window, images, chess_engine,
-                                   valid_moves, coordinates)
-
-        if not valid_moves:  # game over
-            scoreboard.show_text()
-
-        pygame.display.flip()
+        # sleep until something happens instead of redrawing every frame
+        event = pygame.event.wait()
+        if event.type == pygame.QUIT:
+            analysis.close()
+            sys.exit()
+
+        if event.type == ANALYSIS_EVENT:
+            info = analysis.latest()
+            if info is not None and info.pv:
+                show_analysis(eval_bar, info)
+
+        if event.type == pygame.WINDOWEXPOSED:
+            renderer.invalidate()
+            renderer.draw(chess_engine.board, coordinates, valid_moves)
+            eval_bar.draw()
+            if not valid_moves:  # game over
+                scoreboard.show_text()
+
+        if event.type == pygame.KEYDOWN:
+            ply = history.ply
+            if event.key == pygame.K_LEFT:
+                history.undo()
+            elif event.key == pygame.K_RIGHT:
+                history.redo()
+            elif event.key == pygame.K_PAGEUP:
+                history.jump(ply - PAGE_PLIES)
+            elif event.key == pygame.K_PAGEDOWN:
+                history.jump(ply + PAGE_PLIES)
+            elif event.key == pygame.K_HOME:
+                history.jump(0)
+            elif event.key == pygame.K_END:
+                history.jump(len(history))
+            if history.ply != ply:
+                # calculate new valid moves
+                valid_moves = chess_engine.get_valid_moves()
+                analysis.analyse(chess_engine)
+                coordinates.clear()
+                # the game over text may cover any square
+                renderer.invalidate()
+                renderer.draw(chess_engine.board, history.last_move_squares(), valid_moves)
+                if not valid_moves:  # game over
+                    show_game_over(eval_bar, scoreboard, chess_engine)
+
+        if valid_moves:
+            # clicks on the evaluation bar, right of the board, are ignored
+            if (event.type == pygame.MOUSEBUTTONDOWN and event.button == 1
+                    and event.pos[0] < BOARD_SIZE):
+                ply = history.ply
+                pf.move_pieces(renderer, chess_engine, history,
+                               valid_moves, coordinates, event.pos)
+                if history.ply != ply:
+                    analysis.analyse(chess_engine)
+                if not valid_moves:  # game over
+                    show_game_over(eval_bar, scoreboard, chess_engine)
 
 
 if __name__ == "__main__":
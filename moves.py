@@ -1,42 +1,121 @@
-"""Module containing all classses that handle different moves
+"""Module containing the compact move encoding
+
+Moves are plain ints, so generating, storing and comparing them costs no
+more than for any other number:
+
+    bits 0-5    start square
+    bits 6-11   end square
+    bits 12-14  type of the piece a pawn promotes to (0 if none)
+    bits 15-16  NORMAL, CASTLING or EN_PASSANT
+    bits 17-20  code of the moving piece
+    bits 21-24  code of the captured piece (0 if none)
+
+Squares and piece codes are the ones defined in the bitboard module.
 
 Classes:
     Move
-    CastlingMove
-    EnPassantMove
     CastlingRights
+
+Functions:
+    encode_move
 """
+from bitboard import PIECE_NAMES, EMPTY, PAWN
+
+NORMAL = 0
+CASTLING = 1
+EN_PASSANT = 2
+
+PROMOTION_SHIFT = 12
+FLAG_SHIFT = 15
+PIECE_SHIFT = 17
+CAPTURED_SHIFT = 21
+
+
+def encode_move(start, end, piece, captured=EMPTY, promotion=0, flag=NORMAL):
+    return (start | end << 6 | promotion << PROMOTION_SHIFT | flag << FLAG_SHIFT
+            | piece << PIECE_SHIFT | captured << CAPTURED_SHIFT)
+
+
+class Move(int):
+    """Read-only view of an encoded move, used to easily access info about it
+
+    Move(move) costs no more than an int and compares and hashes like the
+    move it wraps.
+    """
+
+    __slots__ = ()
+
+    @property
+    def start(self):
+        return self & 63
+
+    @property
+    def end(self):
+        return self >> 6 & 63
+
+    @property
+    def start_row(self):
+        return self >> 3 & 7
+
+    @property
+    def start_col(self):
+        return self & 7
+
+    @property
+    def end_row(self):
+        return self >> 9 & 7
 
+    @property
+    def end_col(self):
+        return self >> 6 & 7
 
-class Move():
-    """class used to store and easily access info about moves"""
+    @property
+    def move_id(self):
+        """Start square, end square and promotion, which identify the move"""
+        return self & 0x7FFF
 
-    def __init__(self, coordinates, board):
-        self.start_row = coordinates[0][0]
-        self.start_col = coordinates[0][1]
+    @property
+    def flag(self):
+        return self >> FLAG_SHIFT & 3
 
-        self.end_row = coordinates[1][0]
-        self.end_col = coordinates[1][1]
+    @property
+    def piece(self):
+        return PIECE_NAMES[self >> PIECE_SHIFT & 15]
 
-        self.move_id = self.start_row * 1000 + self.start_col * \
-            100 + self.end_row * 10 + self.end_col
+    @property
+    def captured(self):
+        return PIECE_NAMES[self >> CAPTURED_SHIFT & 15]
 
-        self.piece = board[self.start_row][self.start_col]
-        # store piece at end position to revert move if needed
-        self.captured = board[self.end_row][self.end_col]
+    @property
+    def promotion(self):
+        """Name of the piece a pawn promotes to, None for other moves"""
+        kind = self >> PROMOTION_SHIFT & 7
+        if not kind:
+            return None
+        return PIECE_NAMES[(self >> PIECE_SHIFT & 8) | kind]
 
-        self.is_promotion = False
-        if self.piece[1] == "P":
-            if self.end_row == 0 or self.end_row == 7:
-                self.is_promotion = True
+    @property
+    def is_promotion(self):
+        return bool(self >> PROMOTION_SHIFT & 7)
+
+    @property
+    def is_castling(self):
+        return self >> FLAG_SHIFT & 3 == CASTLING
+
+    @property
+    def is_en_passant(self):
+        return self >> FLAG_SHIFT & 3 == EN_PASSANT
 
     def __repr__(self):
+        if self.is_castling:
+            return "0-0-0" if self.end_col == 2 else "0-0"
+
         piece_notation = self.piece[-1]
         promotion_notation = ""
-        if self.piece[-1] == 'P' or self.is_promotion:
+        if self >> PIECE_SHIFT & 7 == PAWN:
             piece_notation = ""
         if self.is_promotion:
-            promotion_notation = "=" + self.piece[-1]
+            promotion_notation = "=" + self.promotion[-1]
 
         start = self.get_letter_number(self.start_row, self.start_col)
         end = self.get_letter_number(self.end_row, self.end_col)
@@ -50,11 +129,15 @@ class Move():
 
         return piece_notation + end + promotion_notation
 
-    # method to compare instances of Move
-    def __eq__(self, other):
-        if isinstance(other, Move):
-            return self.move_id == other.move_id
-        return False
+    __str__ = __repr__
+
+    def get_uci(self):
+        """Return the move in long algebraic notation (e.g. e2e4, e7e8q)"""
+        start = self.get_letter_number(self.start_row, self.start_col)
+        end = self.get_letter_number(self.end_row, self.end_col)
+        if self.is_promotion:
+            return start + end + self.promotion[-1].lower()
+        return start + end
 
     def get_letter_number(self, row, col):
         rows_notation = [str(r) for r in range(8, 0, -1)]
@@ -66,33 +149,6 @@ class Move():
         return letter + number
 
 
-class CastlingMove(Move):
-    """Child class of Move used to handle castling"""
-
-    def __init__(self, coordinates, board, r_start_col):
-        super().__init__(coordinates, board)
-
-        self.r_start_col = r_start_col
-        if self.r_start_col == 0:
-            self.r_end_col = 3
-        else:
-            self.r_end_col = 5
-
-    def __repr__(self):
-        return "0-0-0" if self.r_start_col == 0 else "0-0"
-
-
-class EnPassantMove(Move):
-    """Child class of Move used to handle en passant captures"""
-
-    def __init__(self, coordinates, board):
-        super().__init__(coordinates, board)
-        self.captured_row = self.start_row
-        self.captured_col = self.end_col
-
-        self.captured = board[self.captured_row][self.captured_col]
-
-
 class CastlingRights():
     """Class used to store a player's castling rights"""
 
@@ -0,0 +1,197 @@
+"""Module containing a multi-process search that splits the root moves
+
+Each legal root move is searched by a worker process of a process pool,
+one iteration of iterative deepening at a time. The best move of the last
+iteration is searched first, with a full window; the other moves then
+only have to prove, all at once with a null window, that they are no
+better, and those that fail high are searched again with the full window
+above the best score. Workers receive positions
+as a Position snapshot plus the Zobrist keys needed for repetition checks, never as
+pickled ChessEngine objects, and keep their own transposition table
+between iterations.
+
+Usage:
+    with ParallelSearch(workers=4, tablebases="tables") as searcher:
+        result = searcher.search(engine, time_limit=10)
+        print(result.best_move, result.worker_nodes)
+
+Classes:
+    ParallelSearch
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_engine import ChessEngine
+from search import Search, SearchResult
+from search import MATE_SCORE, MAX_PLY, INFINITY
+
+# transposition table of the worker process, reused by every task it runs
+_worker_table = {}
+# tablebases of the worker process by directory
+_worker_tablebases = {}
+
+
+def search_position(position, depth, deadline, tablebases=None, below_root=True,
+                    alpha=-INFINITY, beta=INFINITY):
+    """Search a serialized position in a worker process
+
+    tablebases is a directory of endgame tables, opened once per worker.
+    A position below_root, after a root move, scores 0 when it is a draw
+    by the fifty-move rule or repetition; a root position is always
+    searched. A score outside the alpha, beta window is only a bound. Return whether the search completed, its score, principal variation,
+    node count and the id of the worker process.
+    """
+    snapshot, keys = position
+    engine = ChessEngine.from_snapshot(snapshot)
+    # keys of the earlier positions, for repetition checks only
+    engine.key_log.extend(keys)
+    # one ply below the root, Search checks for draws and probes the
+    # tablebases before searching
+    if below_root and (engine.halfmove_clock >= 100 or engine.zobrist_key in keys):
+        return True, 0, [], 0, os.getpid()
+    if tablebases is not None and tablebases not in _worker_tablebases:
+        from tablebase import Tablebases
+        _worker_tablebases[tablebases] = Tablebases(tablebases)
+    searcher = Search(engine, tablebases=_worker_tablebases.get(tablebases))
+    searcher.table = _worker_table
+    if below_root and searcher.tablebases is not None:
+        score = searcher.probe_tablebases(0)
+        if score is not None:
+            return True, score, [], 0, os.getpid()
+
+    time_limit = None if deadline is None else max(deadline - time.time(), 0.001)
+    iterations = []
+    result = searcher.search(depth, time_limit, callback=iterations.append,
+                             alpha=alpha, beta=beta)
+    completed = ((bool(iterations) and result.depth >= depth) or result.best_move is None
+                 or abs(result.score) >= MATE_SCORE - MAX_PLY)
+    return completed, result.score, result.pv, result.nodes, os.getpid()
+
+
+class ParallelSearch():
+    """Search root moves in parallel on a pool of worker processes"""
+
+    def __init__(self, workers=None, tablebases=None):
+        self.workers = workers or os.cpu_count() or 1
+        # directory of endgame tables probed by the workers
+        self.tablebases = tablebases
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def search(self, engine, max_depth=MAX_PLY, time_limit=None, callback=None):
+        """Search the position of engine and return a SearchResult
+
+        The result also has a worker_nodes dict with the nodes searched by
+        each worker process, to measure how well the search scales.
+        """
+        start_time = time.perf_counter()
+        deadline = None if time_limit is None else time.time() + time_limit
+
+        result = SearchResult()
+        result.worker_nodes = {}
+        root_moves = engine.get_valid_moves()
+        if not root_moves:
+            result.score = -MATE_SCORE if engine.checkmate else 0
+            return result
+        result.best_move = root_moves[0]
+
+        positions = []
+        for move in root_moves:
+            engine.make_move(move)
+            clock = engine.halfmove_clock
+            keys = tuple(engine.key_log[-clock:]) if clock else ()
+            positions.append((engine.snapshot(), keys))
+            engine.undo_move()
+
+        # the root moves themselves make up the first ply, so a depth of 1
+        # only searches captures after them
+        positions = dict(zip(root_moves, positions))
+        for depth in range(1, min(max_depth, MAX_PLY) + 1):
+            # young brothers wait: the other moves need the score of the first
+            completed, best_score, pv = self.search_move(
+                result, positions[root_moves[0]], depth, deadline)
+            best_pv = [root_moves[0]] + pv
+            futures = []
+            if completed:
+                window = to_child(best_score)
+                futures = [(move, self.executor.submit(
+                    search_position, positions[move], depth - 1, deadline, self.tablebases,
+                    True, window - 1, window)) for move in root_moves[1:]]
+            for move, future in futures:
+                finished, score, pv = self.add_result(result, future.result())
+                if finished and score > best_score:
+                    # better than the best move so far: find by how much
+                    finished, score, pv = self.search_move(
+                        result, positions[move], depth, deadline, best_score)
+                    if finished and score > best_score:
+                        best_score = score
+                        best_pv = [move] + pv
+                completed = completed and finished
+            if not completed:
+                break  # out of time, keep the last complete iteration
+
+            result.depth = depth
+            result.score = best_score
+            result.pv = best_pv
+            result.best_move = best_pv[0]
+            result.elapsed = time.perf_counter() - start_time
+            if callback is not None:
+                callback(result)
+            root_moves.remove(result.best_move)
+            root_moves.insert(0, result.best_move)
+
+            if abs(best_score) >= MATE_SCORE - MAX_PLY:
+                break
+            if deadline is not None and time.time() > deadline - time_limit / 2:
+                break
+
+        result.elapsed = time.perf_counter() - start_time
+        return result
+
+    def search_move(self, result, position, depth, deadline, alpha=-INFINITY):
+        """Search the position after a root move with the window above
+        alpha and return whether it completed, its score and principal
+        variation"""
+        future = self.executor.submit(search_position, position, depth - 1, deadline,
+                                      self.tablebases, True, -INFINITY, to_child(alpha))
+        return self.add_result(result, future.result())
+
+    def add_result(self, result, task):
+        """Count the nodes of a finished search_position task and return
+        whether it completed, its score for the root and principal
+        variation"""
+        finished, score, pv, nodes, worker = task
+        result.worker_nodes[worker] = result.worker_nodes.get(worker, 0) + nodes
+        result.nodes += nodes
+        return finished, to_root(score), pv
+
+
+def to_root(score):
+    """Return the score of the position after a root move as a score of
+    the root, one ply higher"""
+    if score > MATE_SCORE - MAX_PLY:
+        return -score + 1
+    if score < -MATE_SCORE + MAX_PLY:
+        return -score - 1
+    return -score
+
+
+def to_child(score):
+    """Return the score of the position after a root move matching a score
+    of the root, the inverse of to_root"""
+    if score >= INFINITY or score <= -INFINITY:
+        return -score
+    if score > MATE_SCORE - MAX_PLY:
+        return -score - 1
+    if score < -MATE_SCORE + MAX_PLY:
+        return -score + 1
+    return -score
@@ -0,0 +1,163 @@
+"""Count the leaf nodes of the move tree to check and benchmark move generation
+
+Usage:
+    python perft.py 4                           # start position to depth 4
+    python perft.py 3 --fen "<FEN>" --divide    # node count for each root move
+    python perft.py --suite --depth 3           # check the reference positions
+"""
+import argparse
+import sys
+import time
+
+from chess_engine import ChessEngine
+from chess_engine import START_FEN
+from moves import Move
+
+
+# (name, FEN, node counts for depth 1, 2, 3, ...)
+REFERENCE_POSITIONS = [
+    ("start", START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("discovered checks", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+    # small positions built around en passant, castling and promotion traps
+    ("illegal ep move 1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     [18, 92, 1670, 10138, 185429, 1134888]),
+    ("illegal ep move 2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     [13, 102, 1266, 10276, 135655, 1015133]),
+    ("ep capture checks", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     [15, 126, 1928, 13931, 206379, 1440467]),
+    ("short castle check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+     [15, 66, 1198, 6399, 120330, 661072]),
+    ("long castle check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+     [16, 71, 1286, 7418, 141077, 803711]),
+    ("castling rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+     [26, 1141, 27826, 1274206]),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+     [44, 1494, 50509, 1720476]),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+     [11, 133, 1442, 19174, 266199, 3821001]),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+     [29, 165, 5160, 31961, 1004658]),
+    ("promote to check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+     [9, 40, 472, 2661, 38983, 217342]),
+    ("underpromote to check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+     [6, 27, 273, 1329, 18135, 92683]),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+     [2, 6, 13, 63, 382, 2217]),
+    ("stalemate and mate 1", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1",
+     [10, 25, 268, 926, 10857, 43261, 567584]),
+    ("stalemate and mate 2", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     [37, 183, 6559, 23527]),
+]
+
+
+def perft(engine, depth):
+    """Return the number of leaf nodes depth plies below the current position"""
+    moves = engine.get_valid_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for move in moves:
+        engine.make_move(move)
+        nodes += perft(engine, depth - 1)
+        engine.undo_move()
+    return nodes
+
+
+def divide(engine, depth):
+    """Return a list of (move, nodes) pairs, one for each legal root move"""
+    results = []
+    for move in engine.get_valid_moves():
+        engine.make_move(move)
+        results.append((move, perft(engine, depth - 1)))
+        engine.undo_move()
+    return results
+
+
+def run_suite(max_depth, out=sys.stdout):
+    """Check every reference position up to max_depth
+
+    Print the node count, time and speed of each position and return
+    True only if all counts match the reference values.
+    """
+    all_ok = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, counts in REFERENCE_POSITIONS:
+        depth = min(max_depth, len(counts))
+        engine = ChessEngine.from_fen(fen)
+        start = time.perf_counter()
+        nodes = perft(engine, depth)
+        elapsed = time.perf_counter() - start
+        ok = nodes == counts[depth - 1]
+        all_ok = all_ok and ok
+        total_nodes += nodes
+        total_time += elapsed
+        print(f"{name:<22} depth {depth}  {nodes:>10} nodes  {elapsed:7.2f} s  "
+              f"{nodes_per_second(nodes, elapsed):>8} nps  {'ok' if ok else 'FAIL'}",
+              file=out)
+        if not ok:
+            print(f"  expected {counts[depth - 1]} nodes for {fen}", file=out)
+
+    print(f"total {total_nodes} nodes in {total_time:.2f} s, "
+          f"{nodes_per_second(total_nodes, total_time)} nps", file=out)
+    return all_ok
+
+
+def nodes_per_second(nodes, elapsed):
+    return int(nodes / elapsed) if elapsed > 0 else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("depth", type=int, nargs="?", default=None,
+                        help="search depth, maximum depth for --suite (default: 3)")
+    parser.add_argument("--fen", default=START_FEN,
+                        help="position to search (default: start position)")
+    parser.add_argument("--divide", action="store_true",
+                        help="print the node count of every root move")
+    parser.add_argument("--suite", action="store_true",
+                        help="check the node counts of the reference positions")
+    parser.add_argument("--depth", dest="depth_option", type=int, default=None,
+                        help="the same as the depth argument")
+    args = parser.parse_args(argv)
+    if args.depth is not None and args.depth_option is not None \
+            and args.depth != args.depth_option:
+        parser.error("depth given twice with different values")
+    depth = args.depth if args.depth is not None else args.depth_option
+    if depth is None:
+        depth = 3
+
+    if args.suite:
+        return 0 if run_suite(depth) else 1
+
+    engine = ChessEngine.from_fen(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        nodes = 0
+        for move, count in divide(engine, depth):
+            print(f"{Move(move).get_uci()}: {count}")
+            nodes += count
+        print()
+    else:
+        nodes = perft(engine, depth)
+    elapsed = time.perf_counter() - start
+
+    print(f"Nodes: {nodes}")
+    print(f"Time: {elapsed:.3f} s")
+    print(f"NPS: {nodes_per_second(nodes, elapsed)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""Module containing a streaming PGN reader and game replayer
+
+Games are read one at a time from plain or gzip-compressed files, so
+archives of any size can be processed in constant memory.
+
+Usage:
+    for game in read_games("games.pgn.gz"):
+        engine = game.start_engine()
+        for move in replay(game, engine):
+            ...  # engine is in the position after move
+
+Run as a script to time the replay of a whole archive:
+    python pgn.py games.pgn.gz [--trusted]
+
+Classes:
+    PGNError
+    PGNGame
+
+Functions:
+    open_pgn
+    read_games
+    parse_san
+    replay
+"""
+import argparse
+import gzip
+import re
+import sys
+import time
+
+from chess_engine import ChessEngine
+from bitboard import WHITE, BLACK, EMPTY
+from bitboard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from bitboard import KNIGHT_ATTACKS, KING_ATTACKS
+from bitboard import rook_attacks, bishop_attacks
+from moves import encode_move
+from moves import CASTLING, EN_PASSANT
+from moves import PROMOTION_SHIFT, FLAG_SHIFT, PIECE_SHIFT
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s(){};]+")
+SAN_PATTERN = re.compile(
+    r"^(?P<piece>[NBRQK])?(?P<file>[a-h])?(?P<rank>[1-8])?x?"
+    r"(?P<end>[a-h][1-8])(?:=?(?P<promotion>[NBRQ]))?[+#]?[!?]*$")
+CASTLING_PATTERN = re.compile(r"^(?:O-O(?P<long>-O)?|0-0(?P<zero_long>-0)?)[+#]?[!?]*$")
+PIECE_TYPES = {"N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING}
+
+
+class PGNError(ValueError):
+    """Raised when a game cannot be parsed or contains an illegal move"""
+
+
+class PGNGame():
+    """Class used to store the tag pairs and moves of a game"""
+
+    def __init__(self, headers, san_moves, result):
+        self.headers = headers
+        self.san_moves = san_moves
+        self.result = result
+
+    def start_engine(self):
+        """Return an engine in the starting position of the game"""
+        if "FEN" in self.headers:
+            return ChessEngine.from_fen(self.headers["FEN"])
+        return ChessEngine()
+
+    def __repr__(self):
+        white = self.headers.get("White", "?")
+        black = self.headers.get("Black", "?")
+        return f"{white} - {black} {self.result} ({len(self.san_moves)} plies)"
+
+
+def open_pgn(path):
+    """Open a PGN file as text, decompressing it if it is gzipped"""
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    if compressed:
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def read_games(source):
+    """Yield every game of a PGN file path or text stream, one at a time"""
+    if isinstance(source, str):
+        with open_pgn(source) as stream:
+            yield from read_games(stream)
+        return
+
+    headers = {}
+    movetext = []
+    for line in source:
+        line = line.strip()
+        if line.startswith("[") and not _in_comment(movetext):
+            if movetext:
+                # a new game starts without a blank line after the last one
+                yield _make_game(headers, movetext)
+                headers = {}
+                movetext = []
+            tag = line[1:-1].split(None, 1)
+            if len(tag) == 2:
+                headers[tag[0]] = tag[1].strip('"')
+        elif line:
+            movetext.append(line)
+        elif movetext and not _in_comment(movetext):
+            yield _make_game(headers, movetext)
+            headers = {}
+            movetext = []
+
+    if movetext or headers:
+        yield _make_game(headers, movetext)
+
+
+def _in_comment(movetext):
+    """Check whether the movetext ends inside a {comment}"""
+    return bool(movetext) and movetext[-1].rfind("{") > movetext[-1].rfind("}")
+
+
+def _make_game(headers, movetext):
+    san_moves = []
+    result = headers.get("Result", "*")
+    depth = 0
+    for token in TOKEN_PATTERN.findall("\n".join(movetext)):
+        first = token[0]
+        if first in "{;$" or first.isdigit() and token.endswith("."):
+            continue  # comments, annotations and move numbers
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth:
+            continue  # moves of a variation
+        elif token in RESULTS:
+            result = token
+        else:
+            san_moves.append(token)
+    return PGNGame(headers, san_moves, result)
+
+
+def parse_san(engine, san, trusted=False):
+    """Return the move of engine written as san in Standard Algebraic Notation
+
+    With trusted=True the move is found from the attack tables without
+    generating every legal move, assuming the game is legal; the full legal
+    move list is only used when pins must break a tie.
+    """
+    castling = CASTLING_PATTERN.match(san)
+    if castling:
+        long = bool(castling.group("long") or castling.group("zero_long"))
+        return _resolve_castling(engine, long, trusted, san)
+
+    match = SAN_PATTERN.match(san)
+    if not match:
+        raise PGNError(f"invalid move {san!r}")
+    end = (8 - int(match.group("end")[1])) * 8 + "abcdefgh".index(match.group("end")[0])
+    kind = PIECE_TYPES[match.group("piece")] if match.group("piece") else PAWN
+    promotion = PIECE_TYPES[match.group("promotion")] if match.group("promotion") else 0
+    col = "abcdefgh".index(match.group("file")) if match.group("file") else None
+    row = 8 - int(match.group("rank")) if match.group("rank") else None
+
+    if trusted:
+        candidates = _trusted_candidates(engine, kind, end, promotion)
+    else:
+        candidates = [move for move in engine.get_valid_moves()
+                      if move >> 6 & 63 == end and move >> PIECE_SHIFT & 7 == kind
+                      and move >> PROMOTION_SHIFT & 7 == promotion]
+    if col is not None:
+        candidates = [move for move in candidates if move & 7 == col]
+    if row is not None:
+        candidates = [move for move in candidates if move >> 3 & 7 == row]
+
+    if len(candidates) > 1 and trusted:
+        # only one of them is legal, usually because of a pin
+        legal = set(engine.get_valid_moves())
+        candidates = [move for move in candidates if move in legal]
+    if len(candidates) != 1:
+        raise PGNError(f"{'ambiguous' if candidates else 'illegal'} move {san!r} "
+                       f"in position {engine.to_fen()}")
+    return candidates[0]
+
+
+def _resolve_castling(engine, long, trusted, san):
+    king_sq = 60 if engine.white_to_move else 4
+    end = king_sq - 2 if long else king_sq + 2
+    if trusted:
+        return encode_move(king_sq, end, engine.squares[king_sq], flag=CASTLING)
+    for move in engine.get_valid_moves():
+        if move >> FLAG_SHIFT & 3 == CASTLING and move >> 6 & 63 == end:
+            return move
+    raise PGNError(f"illegal move {san!r} in position {engine.to_fen()}")
+
+
+def _trusted_candidates(engine, kind, end, promotion):
+    """Return the pseudo-legal moves of a piece type to end, found by
+    looking backwards from the end square with the attack tables"""
+    us = WHITE if engine.white_to_move else BLACK
+    piece = us << 3 | kind
+    squares = engine.squares
+    occupied = engine.occupied[WHITE] | engine.occupied[BLACK]
+    captured = squares[end]
+
+    if kind == PAWN:
+        step = -8 if us == WHITE else 8
+        flag = 0
+        if captured == EMPTY and end == engine.en_passant_square:
+            flag = EN_PASSANT
+            captured = (us ^ 1) << 3 | PAWN
+        if captured != EMPTY:
+            sources = [end - step - 1, end - step + 1]
+            sources = [sq for sq in sources
+                       if 0 <= sq <= 63 and abs((sq & 7) - (end & 7)) == 1]
+        elif squares[end - step] == piece:
+            sources = [end - step]
+        else:
+            sources = [end - 2 * step]
+        return [encode_move(sq, end, piece, captured, promotion, flag)
+                for sq in sources if squares[sq] == piece]
+
+    if kind == KNIGHT:
+        sources = KNIGHT_ATTACKS[end]
+    elif kind == BISHOP:
+        sources = bishop_attacks(end, occupied)
+    elif kind == ROOK:
+        sources = rook_attacks(end, occupied)
+    elif kind == QUEEN:
+        sources = rook_attacks(end, occupied) | bishop_attacks(end, occupied)
+    else:
+        sources = KING_ATTACKS[end]
+    sources &= engine.bitboards[piece]
+
+    candidates = []
+    while sources:
+        bit = sources & -sources
+        sources ^= bit
+        candidates.append(encode_move(bit.bit_length() - 1, end, piece, captured))
+    return candidates
+
+
+def replay(game, engine=None, trusted=False):
+    """Play the moves of game on engine, yielding each move once it is made
+
+    The engine defaults to the starting position of the game. With
+    trusted=True moves are not checked for legality, which is faster for
+    archives known to be correct.
+    """
+    if engine is None:
+        engine = game.start_engine()
+    for san in game.san_moves:
+        move = parse_san(engine, san, trusted)
+        engine.make_move(move)
+        yield move
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay every game of a PGN file")
+    parser.add_argument("path")
+    parser.add_argument("--trusted", action="store_true",
+                        help="skip legality checks for faster replay")
+    args = parser.parse_args(argv)
+
+    games = 0
+    plies = 0
+    errors = 0
+    start = time.perf_counter()
+    for game in read_games(args.path):
+        games += 1
+        try:
+            for _ in replay(game, trusted=args.trusted):
+                plies += 1
+        except PGNError as error:
+            errors += 1
+            print(f"game {games}: {error}", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    print(f"{games} games, {plies} plies, {errors} errors in {elapsed:.2f} s "
+          f"({int(plies / elapsed) if elapsed > 0 else 0} plies/s)")
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import pygame
+
+from settings import BOARD_SIZE, SQ_SIZE, EVAL_BAR_WIDTH
+from settings import EVAL_WHITE_COLOR, EVAL_BLACK_COLOR
+from settings import LIGHT_COLOR
+from settings import DARK_COLOR
+from settings import MOVE_COLOR
+from settings import VALID_COLOR
+from moves import Move
+
+
+class BoardRenderer():
+    """Class to draw the board, redrawing only the squares that changed
+
+    The empty board and the highlight surfaces are rendered once. Each
+    call to draw compares what every square should show with what it
+    showed last time and sends only the changed squares to the display.
+    """
+
+    def __init__(self, window, images):
+        self.window = window
+        self.images = images
+
+        colors = [LIGHT_COLOR, DARK_COLOR]
+        self.background = pygame.Surface((8 * SQ_SIZE, 8 * SQ_SIZE)).convert()
+        for row in range(8):
+            for col in range(8):
+                self.background.fill(colors[(row + col) % 2],
+                                     (col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+
+        self.move_highlight = self.make_highlight(MOVE_COLOR)
+        self.valid_highlight = self.make_highlight(VALID_COLOR)
+
+        # (piece, move highlight, valid highlight) shown on each square
+        self.shown = [None] * 64
+
+    @staticmethod
+    def make_highlight(color):
+        highlight = pygame.Surface((SQ_SIZE, SQ_SIZE)).convert()
+        highlight.set_alpha(130)
+        highlight.fill(color)
+        return highlight
+
+    def invalidate(self):
+        """Force the next draw to repaint the whole board"""
+        self.shown = [None] * 64
+
+    def draw(self, pieces, move_squares, valid_moves):
+        """Draw the board with the move squares highlighted, and the valid
+        moves from the first of them"""
+        moved = {row * 8 + col for row, col in move_squares}
+        valid = set()
+        if move_squares:
+            start = move_squares[0][0] * 8 + move_squares[0][1]
+            valid = {move.end for move in map(Move, valid_moves) if move.start == start}
+
+        rects = []
+        for sq in range(64):
+            row, col = divmod(sq, 8)
+            state = (pieces[row][col], sq in moved, sq in valid)
+            if state == self.shown[sq]:
+                continue
+            self.shown[sq] = state
+
+            rect = pygame.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+            self.window.blit(self.background, rect, rect)
+            if state[1]:
+                self.window.blit(self.move_highlight, rect)
+            if state[2]:
+                self.window.blit(self.valid_highlight, rect)
+            if state[0] != "--":
+                self.window.blit(self.images[state[0]], rect)
+            rects.append(rect)
+
+        if rects:
+            pygame.display.update(rects)
+
+
+class EvalBar():
+    """Class to draw the evaluation as a bar right of the board, white
+    filling it from the bottom"""
+
+    def __init__(self, window):
+        self.window = window
+        self.rect = pygame.Rect(BOARD_SIZE, 0, EVAL_BAR_WIDTH, BOARD_SIZE)
+        self.score = 0
+
+    def draw(self, score=None):
+        """Draw the bar for a score in centipawns for white"""
+        if score is not None:
+            self.score = score
+        # expected result of white, as for a rating difference
+        share = 1 / (1 + 10 ** (-max(min(self.score, 2000), -2000) / 400))
+        white_height = round(BOARD_SIZE * share)
+        self.window.fill(EVAL_BLACK_COLOR, self.rect)
+        self.window.fill(EVAL_WHITE_COLOR, (BOARD_SIZE, BOARD_SIZE - white_height,
+                                            EVAL_BAR_WIDTH, white_height))
+        pygame.display.update(self.rect)
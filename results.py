@@ -0,0 +1,21 @@
+"""Module containing game results and draws by insufficient material
+
+Results are stored from the point of view of white, in one signed byte, by
+the game database and the self-play records.
+
+Functions:
+    is_insufficient
+"""
+from bitboard import KNIGHT, BISHOP, KING
+
+WHITE_WINS = 1
+DRAW = 0
+BLACK_WINS = -1
+UNKNOWN = 2
+RESULT_CODES = {"1-0": WHITE_WINS, "1/2-1/2": DRAW, "0-1": BLACK_WINS}
+
+
+def is_insufficient(codes):
+    """Check for material that can never mate: kings and at most one minor piece"""
+    kinds = [code & 7 for code in codes if code & 7 != KING]
+    return all(kind in (BISHOP, KNIGHT) for kind in kinds) and len(kinds) <= 1
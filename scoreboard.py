@@ -1,4 +1,4 @@
-import pygame.font
+import pygame
 from settings import BOARD_SIZE
 from settings import TEXT_COLOR
 from settings import TEXT_BG_COLOR
@@ -25,3 +25,4 @@ class Scoreboard():
         text_rect.center = (BOARD_SIZE // 2, BOARD_SIZE // 2)
 
         self.window.blit(text, text_rect)
+        pygame.display.update(text_rect)
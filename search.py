@@ -0,0 +1,413 @@
+"""Module containing the alpha-beta search used to choose a move
+
+Usage:
+    python search.py --time 5                  # think 5 seconds on the start position
+    python search.py --fen "<FEN>" --depth 6   # search a position to depth 6
+    python search.py --time 5 --workers 4      # split the root moves over 4 processes
+
+Classes:
+    Search
+    SearchResult
+"""
+import argparse
+import sys
+import time
+
+from chess_engine import ChessEngine
+from chess_engine import START_FEN, ALL_MOVES, CAPTURES, PROMOTIONS, QUIETS
+from evaluation import evaluate, PIECE_VALUES
+from moves import Move
+from moves import PROMOTION_SHIFT, PIECE_SHIFT, CAPTURED_SHIFT
+from bitboard import WHITE, BLACK
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 64
+
+# kind of bound stored in the transposition table
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# upper bound of the history scores
+MAX_HISTORY = 1 << 24
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time or node budget runs out"""
+
+
+class SearchResult():
+    """Class used to store the outcome of the last completed iteration"""
+
+    def __init__(self):
+        self.best_move = None
+        self.score = 0
+        self.depth = 0
+        self.pv = []
+        self.nodes = 0
+        self.elapsed = 0.0
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def __repr__(self):
+        return (f"depth {self.depth} score {self.score} nodes {self.nodes} "
+                f"nps {self.nps} pv {' '.join(Move(m).get_uci() for m in self.pv)}")
+
+
+class Search():
+    """Negamax alpha-beta search with iterative deepening
+
+    The search plays moves on the engine it is given and takes them back
+    before returning, so the engine ends up in its original position.
+    The transposition table is kept between searches. Positions covered
+    by tablebases, a tablebase.Tablebases, are scored without searching.
+    """
+
+    def __init__(self, engine, table_size=1 << 20, tablebases=None):
+        self.engine = engine
+        self.table = {}
+        self.table_size = table_size
+        self.tablebases = tablebases
+
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = None
+        self.node_limit = None
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in range(15)]
+        self.pv_table = [[] for _ in range(MAX_PLY + 1)]
+
+    def stop(self):
+        """Ask a running search to return as soon as possible
+
+        Safe to call from another thread.
+        """
+        self.stopped = True
+
+    def search(self, max_depth=MAX_PLY, time_limit=None, node_limit=None, callback=None,
+               alpha=-INFINITY, beta=INFINITY):
+        """Search the current position and return a SearchResult
+
+        time_limit is in seconds, node_limit in nodes; both are checked every
+        1024 nodes. callback is called with the result of every completed
+        iteration. A max_depth of 0 only searches captures, or the evasions
+        of a check. A score outside the alpha, beta window is only a bound.
+        """
+        engine = self.engine
+        start_time = time.perf_counter()
+        self.nodes = 0
+        self.stopped = False
+        self.deadline = None if time_limit is None else start_time + time_limit
+        self.node_limit = node_limit
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in range(15)]
+        if len(self.table) > self.table_size:
+            self.table.clear()
+
+        result = SearchResult()
+        root_moves = engine.get_valid_moves()
+        if not root_moves:
+            result.score = -MATE_SCORE if engine.checkmate else 0
+            return result
+        result.best_move = root_moves[0]
+
+        ply = len(engine.move_log)
+        for depth in range(min(max_depth, 1), min(max_depth, MAX_PLY) + 1):
+            try:
+                score = self.negamax(depth, alpha, beta, 0)
+            except SearchTimeout:
+                # take back the moves of the unfinished iteration
+                while len(engine.move_log) > ply:
+                    engine.undo_move()
+                break
+
+            result.depth = depth
+            result.score = score
+            result.pv = list(self.pv_table[0])
+            if result.pv:
+                result.best_move = result.pv[0]
+            result.nodes = self.nodes
+            result.elapsed = time.perf_counter() - start_time
+            if callback is not None:
+                callback(result)
+
+            if abs(score) >= MATE_SCORE - MAX_PLY:
+                break  # forced mate found
+            if self.deadline is not None and time.perf_counter() > start_time + time_limit / 2:
+                break  # the next iteration would not finish in time
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start_time
+        return result
+
+    def check_limits(self):
+        if self.stopped:
+            raise SearchTimeout
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout
+
+    def is_draw(self):
+        """Check for the fifty-move rule and repetitions since the last
+        capture or pawn move"""
+        engine = self.engine
+        if engine.halfmove_clock >= 100:
+            return True
+        keys = engine.key_log
+        key = engine.zobrist_key
+        for i in range(len(keys) - 2, max(len(keys) - engine.halfmove_clock, 0) - 1, -2):
+            if keys[i] == key:
+                return True
+        return False
+
+    def negamax(self, depth, alpha, beta, ply):
+        engine = self.engine
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self.check_limits()
+        self.pv_table[ply] = []
+
+        if ply and self.is_draw():
+            return 0
+
+        if ply and self.tablebases is not None:
+            score = self.probe_tablebases(ply)
+            if score is not None:
+                return score
+
+        in_check = engine.king_in_check("w" if engine.white_to_move else "b")
+        if in_check:
+            depth += 1  # don't stop the search in the middle of a check sequence
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(alpha, beta, ply)
+
+        key = engine.zobrist_key
+        hash_move = 0
+        entry = self.table.get(key)
+        if entry is not None:
+            entry_depth, score, bound, hash_move = entry
+            if ply and entry_depth >= depth:
+                # mate scores are stored relative to the node
+                if score > MATE_SCORE - MAX_PLY:
+                    score -= ply
+                elif score < -MATE_SCORE + MAX_PLY:
+                    score += ply
+                if bound == EXACT:
+                    # the moves below come from the table, so that the
+                    # principal variation does not stop here
+                    self.pv_table[ply] = self.table_pv(depth)
+                    return score
+                if (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        for move in self.staged_moves(hash_move, ply):
+            engine.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            engine.undo_move()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if alpha >= beta:
+                        if not move >> CAPTURED_SHIFT and not move >> PROMOTION_SHIFT & 7:
+                            self.store_quiet_cutoff(move, depth, ply)
+                        break
+
+        if not best_move:
+            return -MATE_SCORE + ply if in_check else 0
+        if best_score >= beta:
+            bound = LOWER
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        score = best_score
+        if score > MATE_SCORE - MAX_PLY:
+            score += ply
+        elif score < -MATE_SCORE + MAX_PLY:
+            score -= ply
+        self.table[key] = (depth, score, bound, best_move)
+
+        return best_score
+
+    def table_pv(self, length):
+        """Return up to length moves following the hash moves of the table
+        from the current position"""
+        engine = self.engine
+        pv = []
+        seen = set()
+        while len(pv) < length and engine.zobrist_key not in seen:
+            seen.add(engine.zobrist_key)
+            entry = self.table.get(engine.zobrist_key)
+            # the move of another position with the same key is not played
+            if entry is None or entry[3] not in engine.generate_moves(ALL_MOVES):
+                break
+            pv.append(entry[3])
+            engine.make_move(entry[3])
+        for _ in pv:
+            engine.undo_move()
+        return pv
+
+    def probe_tablebases(self, ply):
+        """Return the tablebase score of the position, or None when it is
+        not covered"""
+        engine = self.engine
+        occupied = engine.occupied[WHITE] | engine.occupied[BLACK]
+        if bin(occupied).count("1") > self.tablebases.max_pieces:
+            return None
+        result = self.tablebases.probe(engine)
+        if result is None:
+            return None
+        result, plies = result
+        if result > 0:
+            return MATE_SCORE - ply - plies
+        if result < 0:
+            return -MATE_SCORE + ply + plies
+        return 0
+
+    def quiescence(self, alpha, beta, ply):
+        """Search captures and promotions only, until the position is quiet"""
+        engine = self.engine
+        self.nodes += 1
+        if not self.nodes & 1023:
+            self.check_limits()
+        self.pv_table[ply] = []
+
+        # only positions in check are tested for mate, stalemate is left
+        # to the main search
+        if engine.king_in_check("w" if engine.white_to_move else "b"):
+            if not engine.get_valid_moves():
+                return -MATE_SCORE + ply
+
+        # the side to move can usually do at least as well as the static score
+        stand_pat = evaluate(engine)
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        for move in self.staged_moves(0, ply, quiets=False):
+            engine.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            engine.undo_move()
+
+            if score > alpha:
+                alpha = score
+                self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                if alpha >= beta:
+                    break
+
+        return alpha
+
+    def staged_moves(self, hash_move, ply, quiets=True):
+        """Yield the legal moves, the most promising first: hash move,
+        winning captures by MVV-LVA, promotions, killers, quiet moves by
+        history, then losing captures
+
+        Each stage is generated only when the moves before it are used up,
+        so a cutoff on the hash move or a capture never generates the quiet
+        moves. With quiets=False only captures and promotions are yielded.
+        """
+        engine = self.engine
+        if hash_move:
+            yield hash_move
+
+        captures = engine.generate_moves(CAPTURES)
+        # most valuable victim, least valuable attacker
+        captures.sort(key=lambda move: PIECE_VALUES[move >> CAPTURED_SHIFT & 7] * 8
+                      - (move >> PIECE_SHIFT & 7), reverse=True)
+        them = BLACK if engine.white_to_move else WHITE
+        occupied = engine.occupied[WHITE] | engine.occupied[BLACK]
+        losing = []
+        for move in captures:
+            if move == hash_move:
+                continue
+            if (PIECE_VALUES[move >> CAPTURED_SHIFT & 7] < PIECE_VALUES[move >> PIECE_SHIFT & 7]
+                    and engine.attackers(move >> 6 & 63, them, occupied)):
+                # the victim is defended and worth less than the attacker
+                losing.append(move)
+            else:
+                yield move
+
+        for move in engine.generate_moves(PROMOTIONS):
+            if move != hash_move:
+                yield move
+
+        if quiets:
+            moves = engine.generate_moves(QUIETS)
+            killers = tuple(self.killers[ply])
+            for killer in killers:
+                if killer and killer != hash_move and killer in moves:
+                    yield killer
+            history = self.history
+            moves.sort(key=lambda move: history[move >> PIECE_SHIFT & 15][move >> 6 & 63],
+                       reverse=True)
+            for move in moves:
+                if move != hash_move and move not in killers:
+                    yield move
+
+        yield from losing
+
+    def store_quiet_cutoff(self, move, depth, ply):
+        """Remember a quiet move that caused a beta cutoff"""
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        history = self.history[move >> PIECE_SHIFT & 15]
+        history[move >> 6 & 63] = min(history[move >> 6 & 63] + depth * depth, MAX_HISTORY)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position for the best move")
+    parser.add_argument("--fen", default=START_FEN,
+                        help="position to search (default: start position)")
+    parser.add_argument("--depth", type=int, default=MAX_PLY)
+    parser.add_argument("--time", type=float, default=None,
+                        help="time limit in seconds")
+    parser.add_argument("--nodes", type=int, default=None,
+                        help="node limit")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="search root moves in parallel on this many processes")
+    parser.add_argument("--tablebases", default=None,
+                        help="directory of endgame tables made by tablebase.py")
+    args = parser.parse_args(argv)
+    if args.time is None and args.nodes is None and args.depth == MAX_PLY:
+        args.time = 5.0
+
+    if args.workers and args.nodes is not None:
+        parser.error("--nodes cannot be used with --workers")
+
+    engine = ChessEngine.from_fen(args.fen)
+    if args.workers:
+        from parallel_search import ParallelSearch
+        with ParallelSearch(args.workers, args.tablebases) as searcher:
+            result = searcher.search(engine, args.depth, args.time, callback=print)
+        print(f"nodes per worker {sorted(result.worker_nodes.values())}")
+    else:
+        tablebases = None
+        if args.tablebases:
+            from tablebase import Tablebases
+            tablebases = Tablebases(args.tablebases)
+        result = Search(engine, tablebases=tablebases).search(
+            args.depth, args.time, args.nodes, callback=print)
+    if result.best_move is None:
+        print("no legal moves")
+    else:
+        print(f"bestmove {Move(result.best_move).get_uci()}")
+    print(f"nodes {result.nodes} time {result.elapsed:.2f} s nps {result.nps}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
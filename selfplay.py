@@ -0,0 +1,227 @@
+"""Module containing a self-play runner writing games as binary records
+
+Games are played on a pool of worker processes. Each side picks its moves
+among get_valid_moves with a move picker, any callable taking the engine,
+the legal moves and a random.Random. Games end on the checkmate and
+stalemate flags of the engine, the fifty-move rule, repetitions,
+insufficient material or after max_plies.
+
+Every position of a game is written as a fixed size record: the 46 bytes
+of its Position snapshot, then the game id, the move played next (0 at the
+end of the game), the ply and the result for white. The file can be read
+back with numpy.memmap through load_records.
+
+Usage:
+    python selfplay.py games.bin --games 1000 --workers 4
+    python selfplay.py games.bin --games 100 --picker search --depth 2 --random-plies 8
+    python selfplay.py games.bin --picker book --book book.bin
+
+Classes:
+    RandomPicker
+    SearchPicker
+    BookPicker
+
+Functions:
+    play_game
+    next_game_id
+    self_play
+    load_records
+    boards_from_records
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_engine import ChessEngine
+from chess_engine import POSITION
+from bitboard import WHITE, BLACK
+from results import WHITE_WINS, DRAW, BLACK_WINS, UNKNOWN
+from results import is_insufficient
+from search import Search
+
+# game id, move played next, ply, result; follows the Position bytes
+GAME_FIELDS = struct.Struct("<IIHbx")
+RECORD_SIZE = POSITION.size + GAME_FIELDS.size
+
+# numpy fields of a record after those of encoding.POSITION_FIELDS
+GAME_RECORD_FIELDS = [("game", "<u4"), ("move", "<u4"), ("ply", "<u2"),
+                      ("result", "i1"), ("padding", "u1")]
+
+
+class RandomPicker():
+    """Class used to pick moves uniformly at random"""
+
+    def __call__(self, engine, moves, rng):
+        return rng.choice(moves)
+
+
+class SearchPicker():
+    """Class used to pick the best move of a shallow search"""
+
+    def __init__(self, depth=2, nodes=None):
+        self.depth = depth
+        self.nodes = nodes
+
+    def __call__(self, engine, moves, rng):
+        searcher = Search(engine, table_size=1 << 16)
+        move = searcher.search(self.depth, node_limit=self.nodes).best_move
+        return move if move is not None else rng.choice(moves)
+
+
+class BookPicker():
+    """Class used to pick book moves, and the moves of fallback once the
+    game leaves the book
+
+    The book is opened in each worker process the first time it is used.
+    """
+
+    def __init__(self, path, fallback=None):
+        self.path = path
+        self.fallback = fallback or RandomPicker()
+        self.book = None
+
+    def __getstate__(self):
+        # open books cannot be sent to other processes
+        return dict(self.__dict__, book=None)
+
+    def __call__(self, engine, moves, rng):
+        if self.book is None:
+            from book import OpeningBook
+            self.book = OpeningBook(self.path)
+        move = self.book.choose_move(engine, rng)
+        return int(move) if move is not None else self.fallback(engine, moves, rng)
+
+
+def play_game(picker, game_id=0, seed=None, max_plies=400, random_plies=0):
+    """Play one game and return its records as bytes
+
+    The first random_plies moves are random, so that deterministic
+    pickers still play different games.
+    """
+    rng = random.Random(seed)
+    engine = ChessEngine()
+    records = []
+    moves = engine.get_valid_moves()
+    result = UNKNOWN
+    while True:
+        if engine.checkmate:
+            result = BLACK_WINS if engine.white_to_move else WHITE_WINS
+            break
+        if engine.stalemate or engine.halfmove_clock >= 100 \
+                or engine.key_log.count(engine.zobrist_key) >= 2:
+            result = DRAW
+            break
+        occupied = engine.occupied[WHITE] | engine.occupied[BLACK]
+        if bin(occupied).count("1") <= 3 and is_insufficient([p for p in engine.squares if p]):
+            result = DRAW
+            break
+        if len(records) >= max_plies:
+            break
+
+        if len(records) < random_plies:
+            move = rng.choice(moves)
+        else:
+            move = picker(engine, moves, rng)
+        records.append((engine.snapshot(), move))
+        engine.make_move(move)
+        moves = engine.get_valid_moves()
+    records.append((engine.snapshot(), 0))
+
+    return b"".join(position + GAME_FIELDS.pack(game_id, move, ply, result)
+                    for ply, (position, move) in enumerate(records))
+
+
+def _play_games(picker, first_id, count, seed, max_plies, random_plies):
+    return b"".join(play_game(picker, game_id, seed * 1000003 + game_id, max_plies, random_plies)
+                    for game_id in range(first_id, first_id + count))
+
+
+def next_game_id(path):
+    """Return the id following the last game of a records file, 0 when the
+    file is missing or empty"""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return 0
+    size = os.path.getsize(path)
+    if size % RECORD_SIZE:
+        raise ValueError(f"{path} does not hold whole records")
+    with open(path, "rb") as f:
+        f.seek(size - RECORD_SIZE + POSITION.size)
+        return GAME_FIELDS.unpack(f.read(GAME_FIELDS.size))[0] + 1
+
+
+def self_play(path, games, picker=None, workers=None, max_plies=400, random_plies=0,
+              seed=0, batch=8, log=None):
+    """Play games on a pool of worker processes and append their records
+    to path as they finish
+
+    Game ids go on from the last game already in path. Return the number
+    of records written.
+    """
+    picker = picker or RandomPicker()
+    written = 0
+    start_id = next_game_id(path)
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(path, "ab") as f:
+        batches = [(start_id + first, min(batch, games - first))
+                   for first in range(0, games, batch)]
+        results = executor.map(_play_games, *zip(*[
+            (picker, first, count, seed, max_plies, random_plies) for first, count in batches]))
+        for (first, count), data in zip(batches, results):
+            f.write(data)
+            written += len(data) // RECORD_SIZE
+            if log is not None:
+                log(f"{first + count - start_id}/{games} games, {written} positions")
+    return written
+
+
+def load_records(path):
+    """Return the records of a file as a read-only numpy.memmap"""
+    import numpy as np
+    from encoding import POSITION_FIELDS
+    return np.memmap(path, dtype=np.dtype(POSITION_FIELDS + GAME_RECORD_FIELDS), mode="r")
+
+
+def boards_from_records(records):
+    """Return an (N, 64) int8 array of piece codes, the boards used by
+    batch_evaluation"""
+    from encoding import boards_from_array
+    return boards_from_array(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play games and write them as binary records")
+    parser.add_argument("output")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--picker", choices=("random", "search", "book"), default="random")
+    parser.add_argument("--depth", type=int, default=2, help="depth of the search picker")
+    parser.add_argument("--book", default=None, help="book of the book picker")
+    parser.add_argument("--max-plies", type=int, default=400)
+    parser.add_argument("--random-plies", type=int, default=0,
+                        help="random moves at the start of each game")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.picker == "search":
+        picker = SearchPicker(args.depth)
+    elif args.picker == "book":
+        if args.book is None:
+            parser.error("--picker book needs --book")
+        picker = BookPicker(args.book, SearchPicker(args.depth))
+    else:
+        picker = RandomPicker()
+
+    start_time = time.perf_counter()
+    written = self_play(args.output, args.games, picker, args.workers, args.max_plies,
+                        args.random_plies, args.seed, log=lambda line: print(line, file=sys.stderr))
+    elapsed = time.perf_counter() - start_time
+    print(f"{args.games} games, {written} positions in {elapsed:.1f} s "
+          f"({args.games / elapsed:.1f} games/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Module containing a TCP server hosting many games at once
+
+Clients send one command per line and get one line back, starting with
+"ok" or "error":
+
+    new [FEN]                 start a game, answers its id
+    move <id> <uci>           play a move, answers the new FEN and the result
+    legal <id>                list the legal moves
+    fen <id>                  show the position
+    analyse <id> <ms>         search the position, answers the best move
+    close <id>                end a game
+    stats                     number of games
+    quit                      close the connection
+
+Sessions only keep the position as a 46 byte snapshot, the keys needed to detect
+repetitions and a cached array of legal moves, cleared by every move. All
+sessions share one ChessEngine, set up for each request on the event loop.
+Searches run on a pool of worker processes, so a long analysis never
+blocks the other games.
+
+Usage:
+    python server.py --port 8765 --workers 4
+
+Classes:
+    Session
+    GameServer
+"""
+import argparse
+import asyncio
+import sys
+import time
+from array import array
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from chess_engine import ChessEngine
+from chess_engine import START_FEN, MAX_FULLMOVE_NUMBER
+from moves import Move
+from moves import PROMOTION_SHIFT
+from bitboard import KNIGHT, BISHOP, ROOK, QUEEN
+from parallel_search import search_position
+from search import MAX_PLY
+
+PROMOTION_LETTERS = {"n": KNIGHT, "b": BISHOP, "r": ROOK, "q": QUEEN}
+# longest analysis a client can ask for, in milliseconds
+MAX_ANALYSIS_TIME = 60000
+
+
+class Session():
+    """Class used to store the state of one game"""
+
+    __slots__ = ("position", "keys", "legal", "result")
+
+    def __init__(self, position):
+        self.position = position
+        # keys since the last capture or pawn move, current position last
+        self.keys = array("Q", [position.zobrist_key])
+        # legal moves of the position, None until they are needed
+        self.legal = None
+        self.result = None
+
+
+class GameServer():
+    """Class used to serve games to many clients"""
+
+    def __init__(self, workers=1, max_sessions=100000):
+        self.engine = ChessEngine()
+        self.sessions = {}
+        self.next_id = 1
+        self.max_sessions = max_sessions
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                if command == "quit":
+                    break
+                try:
+                    reply = await self.handle(command)
+                except Exception as error:
+                    # a failed command must not end the connection or the
+                    # other games of the client
+                    reply = f"error {error}"
+                writer.write((reply + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, line):
+        """Answer one command"""
+        tokens = line.split()
+        if not tokens:
+            return "error empty command"
+        command, args = tokens[0], tokens[1:]
+        if command == "new":
+            return self.new_game(" ".join(args) or START_FEN)
+        if command == "stats":
+            return f"ok sessions {len(self.sessions)}"
+
+        if not args or not args[0].isdigit() or int(args[0]) not in self.sessions:
+            return "error unknown game"
+        game_id = int(args[0])
+        session = self.sessions[game_id]
+        if command == "move" and len(args) == 2:
+            return self.play(session, args[1])
+        if command == "legal":
+            return "ok " + " ".join(Move(move).get_uci() for move in self.legal_moves(session))
+        if command == "fen":
+            self.engine.restore(session.position)
+            return f"ok {self.engine.to_fen()}"
+        if command == "analyse" and len(args) == 2 and args[1].isdigit():
+            return await self.analyse(session, min(int(args[1]), MAX_ANALYSIS_TIME))
+        if command == "close":
+            del self.sessions[game_id]
+            return "ok"
+        return "error unknown command"
+
+    def new_game(self, fen):
+        if len(self.sessions) >= self.max_sessions:
+            return "error too many games"
+        try:
+            self.engine.set_fen(fen)
+        except ValueError as error:
+            return f"error {error}"
+        game_id = self.next_id
+        self.next_id += 1
+        self.sessions[game_id] = Session(self.engine.snapshot())
+        return f"ok {game_id}"
+
+    def legal_moves(self, session):
+        """Return the legal moves of a session, generating them only once
+        per position"""
+        if session.legal is None:
+            self.engine.restore(session.position)
+            session.legal = array("I", self.engine.get_valid_moves())
+        return session.legal
+
+    def play(self, session, uci):
+        if session.result is not None:
+            return f"error game over {session.result}"
+        move = self.find_move(session, uci)
+        if move is None:
+            return f"error illegal move {uci}"
+
+        engine = self.engine
+        engine.restore(session.position)
+        if engine.fullmove_number == MAX_FULLMOVE_NUMBER and not engine.white_to_move:
+            return "error game too long"
+        engine.make_move(move)
+        # the session only changes once the new position is known to be
+        # valid, so a failure leaves the game where it was
+        position = engine.snapshot()
+        legal = array("I", engine.get_valid_moves())
+        # earlier positions can never be repeated after a capture or pawn move
+        keys = array("Q") if engine.halfmove_clock == 0 else array("Q", session.keys)
+        keys.append(engine.zobrist_key)
+        session.position, session.keys, session.legal = position, keys, legal
+
+        if not legal:
+            if engine.checkmate:
+                session.result = "0-1 checkmate" if engine.white_to_move else "1-0 checkmate"
+            else:
+                session.result = "1/2-1/2 stalemate"
+        elif engine.halfmove_clock >= 100:
+            session.result = "1/2-1/2 fifty moves"
+        elif session.keys.count(engine.zobrist_key) >= 3:
+            session.result = "1/2-1/2 repetition"
+        return f"ok {engine.to_fen()}" + (f" {session.result}" if session.result else "")
+
+    def find_move(self, session, uci):
+        """Return the legal move written as uci, or None"""
+        if len(uci) not in (4, 5) or uci[0] not in "abcdefgh" or uci[2] not in "abcdefgh" \
+                or uci[1] not in "12345678" or uci[3] not in "12345678":
+            return None
+        start = (8 - int(uci[1])) * 8 + "abcdefgh".index(uci[0])
+        end = (8 - int(uci[3])) * 8 + "abcdefgh".index(uci[2])
+        promotion = PROMOTION_LETTERS.get(uci[4:], 0) if len(uci) == 5 else 0
+        for move in self.legal_moves(session):
+            if (move & 63 == start and move >> 6 & 63 == end
+                    and move >> PROMOTION_SHIFT & 7 == promotion):
+                return move
+        return None
+
+    async def analyse(self, session, milliseconds):
+        if not self.legal_moves(session):
+            return "error no legal moves"
+        loop = asyncio.get_running_loop()
+        position = (session.position, tuple(session.keys[:-1]))
+        deadline = time.time() + milliseconds / 1000
+        _, score, pv, nodes, _ = await loop.run_in_executor(
+            self.executor, partial(search_position, position, MAX_PLY, deadline, below_root=False))
+        if not pv:
+            return "error analysis too short"
+        return (f"ok bestmove {Move(pv[0]).get_uci()} score {score} nodes {nodes} "
+                f"pv {' '.join(Move(move).get_uci() for move in pv)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve games over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used for analysis")
+    parser.add_argument("--max-sessions", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    server = GameServer(args.workers, args.max_sessions)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,12 +4,16 @@ Store all settings
 
 BOARD_SIZE = 512
 SQ_SIZE = BOARD_SIZE // 8
+EVAL_BAR_WIDTH = 24
 
 MOVE_COLOR = (225, 128, 0)
 VALID_COLOR = (0, 255, 0)
 DARK_COLOR = (75, 115, 153)
 LIGHT_COLOR = (234, 233, 210)
 
+EVAL_WHITE_COLOR = (240, 240, 240)
+EVAL_BLACK_COLOR = (40, 40, 40)
+
 TEXT_COLOR = (0, 0, 0)
 TEXT_BG_COLOR = (255, 255, 255)
 
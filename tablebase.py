@@ -0,0 +1,425 @@
+"""Module containing an endgame tablebase generator and prober
+
+Tables are solved by retrograde analysis for a set of material such as
+KQvK, KRvK, KPvK or KRvKP. Every placement of the pieces and side to move
+has one signed byte in the table: 0 for a draw, n > 0 when the side to
+move mates in n plies, and -n - 1 when it is mated in n plies. Illegal
+placements are stored as draws and are never probed.
+
+Moves are generated by ChessEngine itself, so tables follow exactly the
+rules of the engine. Captures and promotions lead into smaller tables,
+which are generated first when they are missing. Castling and en passant
+are ignored. Three pieces take a few seconds to a minute, four pieces
+take tens of minutes.
+
+Usage:
+    python tablebase.py generate KQvK KRvK KPvK --dir tables
+    python tablebase.py probe "8/8/8/4k3/8/8/8/4K2R w - - 0 1" --dir tables
+
+Classes:
+    Table
+    Tablebases
+
+Functions:
+    parse_material
+    material_name
+    generate
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from itertools import product
+
+from chess_engine import ChessEngine
+from bitboard import WHITE, BLACK, EMPTY
+from bitboard import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from bitboard import KNIGHT_ATTACKS, KING_ATTACKS
+from bitboard import rook_attacks, bishop_attacks
+from moves import PROMOTION_SHIFT, CAPTURED_SHIFT
+from results import is_insufficient
+
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# longest distance to mate, in plies, that fits in a signed byte
+MAX_DISTANCE = 127
+
+PIECE_ORDER = "KQRBNP"
+PIECE_LETTERS = {"K": KING, "Q": QUEEN, "R": ROOK, "B": BISHOP, "N": KNIGHT, "P": PAWN}
+KIND_LETTERS = {kind: letter for letter, kind in PIECE_LETTERS.items()}
+
+# magic, number of pieces and up to 7 piece codes
+HEADER = struct.Struct("4sB7s4x")
+MAGIC = b"PYTB"
+
+TABLE_EXTENSION = ".tb"
+
+
+def parse_material(name):
+    """Return the piece codes of a material name such as KRvKP, white
+    pieces first, each side in KQRBNP order"""
+    sides = name.upper().split("V")
+    if len(sides) != 2 or any(side.count("K") != 1 for side in sides):
+        raise ValueError(f"invalid material {name!r}, expected something like KRvKP")
+    codes = []
+    for color, side in zip((WHITE, BLACK), sides):
+        for letter in sorted(side, key=PIECE_ORDER.index):
+            codes.append(color << 3 | PIECE_LETTERS[letter])
+    if len(codes) > 7:
+        raise ValueError(f"too many pieces in {name!r}")
+    return tuple(codes)
+
+
+def material_name(codes):
+    """Return the material name of a list of piece codes"""
+    sides = ["", ""]
+    for code in sorted_codes(codes):
+        sides[code >> 3] += KIND_LETTERS[code & 7]
+    return "v".join(sides)
+
+
+def sorted_codes(codes):
+    """Put piece codes in the order used by tables"""
+    return tuple(sorted(codes, key=lambda code: (code >> 3, PIECE_ORDER.index(KIND_LETTERS[code & 7]))))
+
+
+def decode(value):
+    """Return the (result, plies to mate) of a stored value"""
+    if value > 0:
+        return WIN, value
+    if value < 0:
+        return LOSS, -value - 1
+    return DRAW, 0
+
+
+class Table():
+    """Class used to read the values of one solved table"""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.size = 64 ** len(codes)
+        self.values = values
+
+    @classmethod
+    def open(cls, path):
+        """Open a table file through mmap"""
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, codes = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            data.close()
+            raise ValueError(f"{path} is not a tablebase file")
+        # view the values after the header as signed bytes, without copying
+        values = memoryview(data)[HEADER.size:].cast("b")
+        return cls(tuple(codes[:count]), values)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self.codes), bytes(self.codes)))
+            f.write(self.values)
+
+    def index(self, engine):
+        """Return the index of the position of engine"""
+        index = 0 if engine.white_to_move else self.size
+        used = 0
+        weight = self.size
+        for code in self.codes:
+            # pieces of the same kind are taken in square order
+            pieces = engine.bitboards[code] & ~used
+            bit = pieces & -pieces
+            used |= bit
+            weight //= 64
+            index += (bit.bit_length() - 1) * weight
+        return index
+
+    def probe(self, engine):
+        """Return the (result, plies to mate) of the position of engine"""
+        return decode(self.values[self.index(engine)])
+
+
+class Tablebases():
+    """Class used to probe the tables stored in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for file_name in os.listdir(directory):
+                if file_name.endswith(TABLE_EXTENSION):
+                    count = len(file_name) - len(TABLE_EXTENSION) - 1
+                    self.max_pieces = max(self.max_pieces, count)
+
+    def get_table(self, codes):
+        """Return the table of a material, or None when it is not available"""
+        name = material_name(codes)
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + TABLE_EXTENSION)
+            self.tables[name] = Table.open(path) if os.path.exists(path) else None
+        return self.tables[name]
+
+    def probe(self, engine):
+        """Return the (result, plies to mate) of the position of engine for
+        the side to move, or None when no table covers it"""
+        occupied = engine.occupied[WHITE] | engine.occupied[BLACK]
+        if (engine.castling_rights or engine.en_passant_square is not None
+                or bin(occupied).count("1") > max(self.max_pieces, 2)):
+            return None
+        codes = [engine.squares[sq] for sq in range(64) if engine.squares[sq] != EMPTY]
+        if is_insufficient(codes):
+            return DRAW, 0
+        table = self.get_table(sorted_codes(codes))
+        return None if table is None else table.probe(engine)
+
+    def best_move(self, engine):
+        """Return the legal move that wins fastest, draws, or loses slowest,
+        or None when the position is not covered"""
+        best = None
+        best_key = None
+        for move in engine.get_valid_moves():
+            engine.make_move(move)
+            result = self.probe(engine)
+            engine.undo_move()
+            if result is None:
+                return None
+            result, plies = result
+            # the result is for the opponent, who moves next
+            key = (-result, plies if result == WIN else -plies)
+            if best_key is None or key > best_key:
+                best, best_key = move, key
+        return best
+
+
+def generate(name, directory, log=None):
+    """Solve the table of a material and the smaller tables it leads to,
+    skipping the ones already in directory. Return the path of the table."""
+    codes = parse_material(name)
+    name = material_name(codes)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + TABLE_EXTENSION)
+    if os.path.exists(path):
+        return path
+
+    for child in child_materials(codes):
+        if not is_insufficient(child):
+            generate(material_name(child), directory, log)
+
+    start_time = time.perf_counter()
+    table = solve(codes, Tablebases(directory))
+    table.save(path)
+    if log is not None:
+        log(f"{name}: {2 * table.size} positions in {time.perf_counter() - start_time:.1f} s")
+    return path
+
+
+def child_materials(codes):
+    """Return the materials reached by a capture or a promotion"""
+    children = set()
+    for i, code in enumerate(codes):
+        rest = codes[:i] + codes[i + 1:]
+        if code & 7 != KING:
+            children.add(sorted_codes(rest))
+        if code & 7 == PAWN:
+            for kind in (QUEEN, ROOK, BISHOP, KNIGHT):
+                children.add(sorted_codes(rest + ((code & 8) | kind,)))
+    return children
+
+
+def solve(codes, tablebases):
+    """Return the solved Table of a material
+
+    A forward pass plays every legal move of every position once to count
+    the moves that stay in the table and to score captures and promotions
+    from the smaller tables. Positions are then resolved in order of
+    distance to mate, walking backwards with un-moves from every solved
+    position to the positions that lead to it.
+    """
+    count = len(codes)
+    size = 64 ** count
+    weights = [64 ** (count - 1 - i) for i in range(count)]
+
+    values = array("b", bytes(2 * size))
+    legal = bytearray(2 * size)
+    decided = bytearray(2 * size)
+    # moves staying in the table that are not known to lose yet
+    remaining = bytearray(2 * size)
+    # captures and promotions that draw, and the longest one that loses
+    can_draw = bytearray(2 * size)
+    external_loss = bytearray(2 * size)
+    # buckets[d] holds (index, value) of the positions decided d plies from mate
+    buckets = [[] for _ in range(MAX_DISTANCE + 2)]
+
+    # an empty board, pieces are put on it for each position
+    engine = ChessEngine.from_fen("k6K/8/8/8/8/8/8/8 w - - 0 1")
+    engine.remove_piece(0)
+    engine.remove_piece(7)
+
+    index = -1
+    for color in (WHITE, BLACK):
+        engine.white_to_move = color == WHITE
+        for placement in product(range(64), repeat=count):
+            index += 1
+            if len(set(placement)) < count:
+                continue
+            if any(code & 7 == PAWN and (sq < 8 or sq > 55) for code, sq in zip(codes, placement)):
+                continue
+
+            for sq, code in zip(placement, codes):
+                engine.put_piece(sq, code)
+            if engine.king_in_check("b" if color == WHITE else "w"):
+                for sq in placement:
+                    engine.remove_piece(sq)
+                continue  # the side that just moved left its king in check
+            legal[index] = 1
+
+            moves = engine.get_valid_moves()
+            mated = not moves and engine.checkmate
+            inside = 0
+            win = None
+            for move in moves:
+                if not (move >> CAPTURED_SHIFT or move >> PROMOTION_SHIFT & 7):
+                    inside += 1
+                    continue
+                engine.make_move(move)
+                child = [piece for piece in engine.squares if piece != EMPTY]
+                if is_insufficient(child):
+                    result, plies = DRAW, 0
+                else:
+                    result, plies = tablebases.get_table(sorted_codes(child)).probe(engine)
+                engine.undo_move()
+                if result == LOSS:
+                    win = plies + 1 if win is None else min(win, plies + 1)
+                elif result == DRAW:
+                    can_draw[index] = 1
+                else:
+                    external_loss[index] = max(external_loss[index], plies + 1)
+
+            for sq in placement:
+                engine.remove_piece(sq)
+
+            remaining[index] = inside
+            if mated:
+                buckets[0].append((index, -1))
+            elif not moves:
+                decided[index] = 1  # stalemate
+            elif win is not None:
+                buckets[win].append((index, win))
+            elif not inside and not can_draw[index]:
+                # every move is a capture or promotion that loses
+                buckets[external_loss[index]].append((index, -external_loss[index] - 1))
+            elif not inside:
+                decided[index] = 1  # draw
+
+    for distance, bucket in enumerate(buckets):
+        for index, value in bucket:
+            if decided[index]:
+                continue
+            if distance > MAX_DISTANCE:
+                raise ValueError(f"mate too long to store in {material_name(codes)}")
+            decided[index] = 1
+            values[index] = value
+
+            # walk back to the positions where the other side moved into this one
+            color = WHITE if index < size else BLACK
+            mover = color ^ 1
+            placement = []
+            rest = index % size
+            for weight in weights:
+                placement.append(rest // weight)
+                rest %= weight
+            occupied = 0
+            for sq in placement:
+                occupied |= 1 << sq
+            base = index % size + (mover * size)
+
+            for slot, (code, sq) in enumerate(zip(codes, placement)):
+                if code >> 3 != mover:
+                    continue
+                for origin in unmove_origins(code, sq, occupied):
+                    previous = base + (origin - sq) * weights[slot]
+                    if not legal[previous] or decided[previous]:
+                        continue
+                    if value < 0:
+                        # moving here mates or wins for the mover
+                        buckets[distance + 1].append((previous, distance + 1))
+                    else:
+                        remaining[previous] -= 1
+                        if not remaining[previous] and not can_draw[previous]:
+                            plies = max(distance + 1, external_loss[previous])
+                            buckets[plies].append((previous, -plies - 1))
+
+    return Table(codes, values)
+
+
+def unmove_origins(code, sq, occupied):
+    """Yield the squares a piece could have moved from to reach sq without
+    capturing or promoting"""
+    kind = code & 7
+    if kind == PAWN:
+        step = 8 if code >> 3 == WHITE else -8
+        start_row = 4 if code >> 3 == WHITE else 3
+        origin = sq + step
+        if 8 <= origin <= 55 and not occupied >> origin & 1:
+            yield origin
+            if sq >> 3 == start_row and not occupied >> (origin + step) & 1:
+                yield origin + step
+        return
+
+    if kind == KNIGHT:
+        origins = KNIGHT_ATTACKS[sq]
+    elif kind == BISHOP:
+        origins = bishop_attacks(sq, occupied)
+    elif kind == ROOK:
+        origins = rook_attacks(sq, occupied)
+    elif kind == QUEEN:
+        origins = rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+    else:
+        origins = KING_ATTACKS[sq]
+    origins &= ~occupied
+    while origins:
+        bit = origins & -origins
+        origins ^= bit
+        yield bit.bit_length() - 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("generate", help="solve tables and their subtables")
+    build.add_argument("materials", nargs="+", help="materials such as KQvK or KRvKP")
+    build.add_argument("--dir", default="tables")
+
+    probe = commands.add_parser("probe", help="probe a position")
+    probe.add_argument("fen")
+    probe.add_argument("--dir", default="tables")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for name in args.materials:
+            generate(name, args.dir, log=print)
+        return 0
+
+    from moves import Move
+    engine = ChessEngine.from_fen(args.fen)
+    tablebases = Tablebases(args.dir)
+    result = tablebases.probe(engine)
+    if result is None:
+        print("position not in the tablebases")
+        return 1
+    result, plies = result
+    print({WIN: f"win, mate in {plies} plies", DRAW: "draw",
+           LOSS: f"loss, mated in {plies} plies"}[result])
+    move = tablebases.best_move(engine)
+    if move is not None:
+        print(f"best move {Move(move).get_uci()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""Module containing a headless UCI front end for the engine
+
+Commands are read from stdin and answered on stdout by an asyncio loop,
+while searches run in a worker thread, so stop and isready are handled
+at once even in the middle of a search. pygame is never imported.
+
+Usage:
+    python uci.py
+    python uci.py --book book.bin    # play book moves without searching
+
+Classes:
+    UCIEngine
+"""
+import argparse
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from chess_engine import ChessEngine
+from search import Search
+from search import MATE_SCORE, MAX_PLY
+from moves import Move
+
+ENGINE_NAME = "chess-board"
+ENGINE_AUTHOR = "GBergatto"
+
+# share of the remaining clock used for one move when movestogo is unknown
+DEFAULT_MOVES_TO_GO = 30
+# time kept in reserve for communication delays, in seconds
+MOVE_OVERHEAD = 0.05
+
+
+class UCIEngine():
+    """Class used to answer the commands of a UCI chess GUI"""
+
+    def __init__(self, output=None, book=None):
+        self.output = output or sys.stdout
+        # opening book, an OpeningBook from book.py
+        self.book = book
+        self.engine = ChessEngine()
+        self.searcher = Search(self.engine)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.loop = None
+        self.search_task = None
+        self.stop_event = None
+
+    def send(self, line):
+        self.output.write(line + "\n")
+        self.output.flush()
+
+    async def run(self, input=None):
+        """Read and handle commands until quit or the end of input"""
+        input = input or sys.stdin
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        try:
+            while True:
+                line = await self.loop.run_in_executor(None, input.readline)
+                if not line:
+                    break
+                if not await self.handle(line):
+                    break
+        finally:
+            await self.stop_search()
+            self.executor.shutdown()
+
+    async def handle(self, line):
+        """Handle one command, returning False when the engine must quit"""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            await self.stop_search()
+            self.searcher.table.clear()
+        elif command == "position":
+            await self.stop_search()
+            self.set_position(args)
+        elif command == "go":
+            await self.stop_search()
+            self.stop_event.clear()
+            self.search_task = asyncio.create_task(self.go(args))
+        elif command == "stop":
+            await self.stop_search()
+        elif command == "quit":
+            return False
+        return True
+
+    def set_position(self, args):
+        """Set up the position of a 'position [startpos | fen ...] [moves ...]'
+        command"""
+        if "moves" in args:
+            index = args.index("moves")
+            setup, moves = args[:index], args[index + 1:]
+        else:
+            setup, moves = args, []
+
+        try:
+            if setup and setup[0] == "fen":
+                engine = ChessEngine.from_fen(" ".join(setup[1:]))
+            else:
+                engine = ChessEngine()
+        except ValueError as error:
+            self.send(f"info string {error}")
+            return
+
+        for uci in moves:
+            legal = {Move(move).get_uci(): move for move in engine.get_valid_moves()}
+            if uci not in legal:
+                self.send(f"info string illegal move {uci}")
+                break
+            engine.make_move(legal[uci])
+
+        self.engine = engine
+        self.searcher.engine = engine
+
+    async def go(self, args):
+        """Search the current position and send the best move"""
+        options = parse_go(args)
+        time_limit = self.time_limit(options)
+        depth = options.get("depth", MAX_PLY)
+        nodes = options.get("nodes")
+        infinite = "infinite" in options or "ponder" in options
+
+        if self.book is not None and not infinite:
+            move = self.book.choose_move(self.engine)
+            if move is not None:
+                self.send(f"bestmove {move.get_uci()}")
+                return
+
+        def report(result):
+            line = format_info(result)
+            self.loop.call_soon_threadsafe(self.send, line)
+
+        result = await self.loop.run_in_executor(
+            self.executor, self.searcher.search, depth, time_limit, nodes, report)
+
+        if infinite:
+            # the GUI expects no best move before it says stop
+            await self.stop_event.wait()
+        if result.best_move is None:
+            self.send("bestmove 0000")
+        else:
+            self.send(f"bestmove {Move(result.best_move).get_uci()}")
+
+    async def stop_search(self):
+        """Stop a running search and wait for it to send its best move"""
+        if self.search_task is None:
+            return
+        self.stop_event.set()
+        while not self.search_task.done():
+            # repeated in case the search thread has not started yet
+            self.searcher.stop()
+            await asyncio.wait([self.search_task], timeout=0.01)
+        self.search_task = None
+
+    def time_limit(self, options):
+        """Return the seconds to spend on this move, or None for no limit"""
+        if "movetime" in options:
+            return max(options["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+        side = "w" if self.engine.white_to_move else "b"
+        if f"{side}time" not in options:
+            return None
+        remaining = options[f"{side}time"] / 1000
+        increment = options.get(f"{side}inc", 0) / 1000
+        moves_to_go = options.get("movestogo", DEFAULT_MOVES_TO_GO)
+        budget = remaining / moves_to_go + increment * 3 / 4
+        return max(min(budget, remaining - MOVE_OVERHEAD), 0.01)
+
+
+def parse_go(args):
+    """Return the options of a 'go' command as a dict of ints, with None for
+    flags such as infinite"""
+    options = {}
+    i = 0
+    while i < len(args):
+        name = args[i]
+        if name in ("infinite", "ponder"):
+            options[name] = None
+            i += 1
+        elif i + 1 < len(args) and args[i + 1].lstrip("-").isdigit():
+            options[name] = int(args[i + 1])
+            i += 2
+        else:
+            i += 1  # searchmoves and unknown options are ignored
+    return options
+
+
+def format_info(result):
+    """Return the UCI info line of a completed iteration"""
+    if abs(result.score) >= MATE_SCORE - MAX_PLY:
+        plies = MATE_SCORE - abs(result.score)
+        moves = (plies + 1) // 2
+        score = f"mate {moves if result.score > 0 else -moves}"
+    else:
+        score = f"cp {result.score}"
+    pv = " ".join(Move(move).get_uci() for move in result.pv)
+    return (f"info depth {result.depth} score {score} nodes {result.nodes} "
+            f"nps {result.nps} time {int(result.elapsed * 1000)} pv {pv}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the engine over UCI")
+    parser.add_argument("--book", default=None,
+                        help="Polyglot opening book to play from")
+    args = parser.parse_args(argv)
+
+    book = None
+    if args.book:
+        from book import OpeningBook
+        book = OpeningBook(args.book)
+    try:
+        asyncio.run(UCIEngine(book=book).run())
+    finally:
+        if book is not None:
+            book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())